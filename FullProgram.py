@@ -1,187 +1,80 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import sqlite3 as sql
 import pytesseract 
-from PIL import Image
-import PyPDF2 as pdfread
 import io
-from llama_cpp import Llama
-import json
 import random
 import time
 import streamlit_authenticator as stauth
 import yaml
 from yaml.loader import SafeLoader
 import os
-import datetime
+import settings
+import llm_engine
+import generation_cache
+import job_queue
+import metrics
+import dedupe
+import review
+import deck_io
+import quiz
+from database import (init_db, save_deck, add_cards_to_deck, list_user_decks, get_user_deck_page,
+                      get_deck_flashcards, delete_deck, search_flashcards)
+from text_processing import document_header
+from extraction import extract_pdf_text, ocr_images
+# Time the whole script run so the cost of a rerun can be shown
+run_start_time = time.perf_counter()
+
 # Set up Tesseract OCR
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_PATH
 
-# Initialize database for storing flashcard decks
-def init_db():
-    conn = sql.connect('flashcards.db')
-    c = conn.cursor()
-    
-    # Create tables if they don't exist (without dropping existing ones)
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY, password TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS decks
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  username TEXT, 
-                  deck_name TEXT, 
-                  created_date TEXT,
-                  FOREIGN KEY (username) REFERENCES users(username))''')
-    c.execute('''CREATE TABLE IF NOT EXISTS flashcards
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  deck_id INTEGER, 
-                  question TEXT, 
-                  answer TEXT,
-                  FOREIGN KEY (deck_id) REFERENCES decks(id))''')
-    conn.commit()
-    conn.close()
+# Initialize the database once per server process, not on every rerun
+@st.cache_resource
+def init_database():
+    init_db()
 
-# Initialize the database
-init_db()
+init_database()
 
 # Load Llama Model (cache it to optimize performance)
 @st.cache_resource
 def load_llm():
-    return Llama(
-        model_path="./Phi-3-mini-4k-instruct-q4.gguf",
-        n_ctx=4096,
-        n_threads=8,
-        n_gpu_layers=35
-    )
+    return llm_engine.load_model()
+
+# Start the background generation worker once per server process
+@st.cache_resource
+def start_job_worker():
+    return job_queue.start_worker(load_llm)
 
 # Function to generate flashcards from text using the Llama model
 @st.cache_data
 def generate_flashcards(text, _llm):
-    if not text or len(text.strip()) == 0:
-        return []
-    
-    prompt = """
-    Based on the following text, generate 5-10 flashcards based on the amount of content in JSON format.
-    Each flashcard should have a "question" and "answer" field.
-    The questions should test understanding of key concepts from the text.
-    Format the response as a valid JSON array of objects.
-    Be creative with the questions.
-    
-    Example format:
-    [
-        {"question": "What is the main idea of the text?", "answer": "The main idea is..."},
-        {"question": "Define the term X", "answer": "X is defined as..." }
-        {"question": "What is true for X", "answer": "Y is true when X..."}
-    ]
-    
-    Text to generate flashcards from:
-    """
-    
-    chunk_size = 1000
-    text_chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    
-    all_flashcards = []
     progress_bar = st.progress(0)
-    
-    # Loop through chunks of the text to get flashcards for each
-    for i, chunk in enumerate(text_chunks):
-        with st.spinner("Reading text..."):
-            llm = load_llm()
-        progress_bar.progress((i + 1) / len(text_chunks))
-        
-        full_prompt = f"<|user|>\n{prompt}\n{chunk}\n<|end|>\n<|assistant|>"
-        
-        output = llm(
-            prompt=full_prompt,
-            max_tokens=1024,
-            stop=["<|end|>"],
-            echo=False
-        )
-        
-        response_text = output['choices'][0]['text']
-        
-        try:
-            json_start = response_text.find('[')
-            json_end = response_text.rfind(']') + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                json_str = response_text[json_start:json_end]
-                flashcards = json.loads(json_str)
-                all_flashcards.extend(flashcards)
-        except Exception as e:
-            st.warning(f"Could not parse flashcards from chunk {i+1}: {str(e)}")
-    
-    return all_flashcards
-
-# Function to clean and optimize text before processing
-def optimize_text(text):
-    # Remove excessive whitespace
-    text = ' '.join(text.split())
-    
-    # Remove very short lines (likely noise)
-    lines = text.split('\n')
-    cleaned_lines = [line for line in lines if len(line.strip()) > 10]
-    
-    # Join back with newlines
-    return '\n'.join(cleaned_lines)
-
-# Function to save a deck of flashcards to the database
-def save_deck(username, deck_name, flashcards):
-    conn = sql.connect('flashcards.db')
-    c = conn.cursor()
-    
-    # Insert the deck
-    created_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT INTO decks (username, deck_name, created_date) VALUES (?, ?, ?)",
-              (username, deck_name, created_date))
-    deck_id = c.lastrowid
-    
-    # Insert all flashcards
-    for card in flashcards:
-        c.execute("INSERT INTO flashcards (deck_id, question, answer) VALUES (?, ?, ?)",
-                  (deck_id, card["question"], card["answer"]))
-    
-    conn.commit()
-    conn.close()
-    return deck_id
-
-# Function to get all decks for a user
-def get_user_decks(username):
-    conn = sql.connect('flashcards.db')
-    c = conn.cursor()
-    c.execute("SELECT id, deck_name, created_date FROM decks WHERE username = ? ORDER BY created_date DESC",
-              (username,))
-    decks = c.fetchall()
-    conn.close()
-    return decks
-
-# Function to get all flashcards in a deck
-def get_deck_flashcards(deck_id):
-    conn = sql.connect('flashcards.db')
-    c = conn.cursor()
-    c.execute("SELECT question, answer FROM flashcards WHERE deck_id = ?", (deck_id,))
-    cards = c.fetchall()
-    conn.close()
-    
-    # Convert to the format expected by the app
-    flashcards = []
-    for card in cards:
-        flashcards.append({"question": card[0], "answer": card[1]})
-    return flashcards
+    return llm_engine.generate_flashcards(
+        text, _llm,
+        progress_callback=lambda done, total: progress_bar.progress(done / total),
+        warning_callback=st.warning
+    )
 
-# Function to delete a deck
-def delete_deck(deck_id):
-    conn = sql.connect('flashcards.db')
-    c = conn.cursor()
-    
-    # Delete all flashcards in the deck
-    c.execute("DELETE FROM flashcards WHERE deck_id = ?", (deck_id,))
-    
-    # Delete the deck
-    c.execute("DELETE FROM decks WHERE id = ?", (deck_id,))
-    
-    conn.commit()
-    conn.close()
+# Function to build the HTML of a flashcard with the flip animation
+def flashcard_html(card, index, total, show_answer, heading=None):
+    return f"""
+        <div class="flashcard-container">
+            <div class="flashcard {'flipped' if show_answer else ''}" id="flashcard">
+                <div class="flashcard-front">
+                    <div class="flashcard-content">
+                        <h3>{heading or f"Question {index + 1}/{total}"}</h3>
+                        <p>{card["question"]}</p>
+                    </div>
+                </div>
+                <div class="flashcard-back">
+                    <div class="flashcard-content">
+                        <h3>Answer</h3>
+                        <p>{card["answer"]}</p>
+                    </div>
+                </div>
+            </div>
+        </div>
+        """
 
 # Custom CSS for styling
 st.markdown("""
@@ -357,6 +250,9 @@ if 'current_deck_id' not in st.session_state:
     st.session_state.current_deck_id = None
 if 'deck_name' not in st.session_state:
     st.session_state.deck_name = ""
+if 'extracted_texts' not in st.session_state:
+    # Extracted text per uploaded file, so reruns don't repeat OCR and PDF parsing
+    st.session_state.extracted_texts = {}
 
 # Authentication page
 if not st.session_state.authenticated:
@@ -429,20 +325,44 @@ st.write(f"Welcome, {st.session_state.username}! Upload one or more documents to
 with st.sidebar:
     st.header("Your Flashcard Decks")
     
-    # Get user's decks
-    user_decks = get_user_decks(st.session_state.username)
+    # Get one page of the user's decks (served from the per-user deck list cache)
+    deck_search = st.text_input("Search decks", key="deck_search")
+    if deck_search != st.session_state.get("last_deck_search", ""):
+        st.session_state.last_deck_search = deck_search
+        st.session_state.deck_page = 0
+    deck_page = st.session_state.get("deck_page", 0)
+    user_decks, deck_count = get_user_deck_page(st.session_state.username, deck_page,
+                                                settings.DECKS_PER_PAGE, deck_search)
+    page_count = max(1, -(-deck_count // settings.DECKS_PER_PAGE))
+    if deck_page >= page_count:
+        st.session_state.deck_page = page_count - 1
+        st.rerun()
     
     if user_decks:
-        st.write(f"You have {len(user_decks)} saved decks:")
-        for deck_id, deck_name, created_date in user_decks:
+        st.write(f"You have {deck_count} {'matching' if deck_search else 'saved'} decks:")
+        for deck_id, deck_name, created_date, card_count in user_decks:
             # Create a button for each deck
-            if st.button(f"{deck_name} ({created_date.split()[0]})", key=f"deck_{deck_id}", use_container_width=True):
+            if st.button(f"{deck_name} ({created_date.split()[0]}, {card_count} cards)", key=f"deck_{deck_id}", use_container_width=True):
                 st.session_state.current_deck_id = deck_id
                 st.session_state.flashcards = get_deck_flashcards(deck_id)
                 st.session_state.current_flashcard = 0
                 st.session_state.show_answer = False
                 st.rerun()
         
+        # Page through the deck list
+        if page_count > 1:
+            prev_col, page_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                if st.button("<", key="deck_page_prev", disabled=deck_page == 0):
+                    st.session_state.deck_page = deck_page - 1
+                    st.rerun()
+            with page_col:
+                st.caption(f"Page {deck_page + 1} of {page_count}")
+            with next_col:
+                if st.button(">", key="deck_page_next", disabled=deck_page >= page_count - 1):
+                    st.session_state.deck_page = deck_page + 1
+                    st.rerun()
+        
         # Add a delete button for the current deck
         if st.session_state.current_deck_id:
             if st.button("Delete Current Deck", key="delete_deck", use_container_width=True):
@@ -451,44 +371,280 @@ with st.sidebar:
                 st.session_state.flashcards = None
                 st.success("Deck deleted successfully!")
                 st.rerun()
+    elif deck_search:
+        st.info("No decks match your search.")
     else:
         st.info("You don't have any saved decks yet. Create one by generating flashcards and saving them.")
+    
+    # Move decks in and out as CSV, JSONL or Anki text files
+    with st.expander("Import / Export"):
+        export_format = st.selectbox("Format", deck_io.FORMATS, key="export_format",
+                                     format_func=lambda fmt: {"csv": "CSV", "jsonl": "JSONL", "anki": "Anki (text)"}[fmt])
+        export_scope = "All decks"
+        if st.session_state.current_deck_id:
+            export_scope = st.radio("Export", ["Current deck", "All decks"], horizontal=True, key="export_scope")
+        if st.button("Prepare export", use_container_width=True):
+            export_file = io.StringIO()
+            deck_ids = [st.session_state.current_deck_id] if export_scope == "Current deck" else None
+            deck_io.export_cards(st.session_state.username, export_file, export_format, deck_ids)
+            st.session_state.export_data = (export_format, export_file.getvalue())
+        if st.session_state.get("export_data") and st.session_state.export_data[0] == export_format:
+            st.download_button("Download", st.session_state.export_data[1], use_container_width=True,
+                               file_name=f"flashcards.{ {'anki': 'txt'}.get(export_format, export_format) }",
+                               mime="text/plain")
+        
+        import_file = st.file_uploader("Import decks", type=["csv", "jsonl", "txt"], key="import_file")
+        if import_file is not None and st.button("Import", use_container_width=True):
+            try:
+                counts = deck_io.import_cards(st.session_state.username,
+                                              io.TextIOWrapper(import_file, encoding="utf-8-sig", newline=""),
+                                              deck_io.format_for_path(import_file.name),
+                                              os.path.splitext(import_file.name)[0])
+                st.toast(f"Imported {sum(counts.values())} flashcards into {len(counts)} decks")
+                st.rerun()
+            except (ValueError, UnicodeDecodeError) as e:
+                st.error(f"Could not import {import_file.name}: {e}")
+    
+    # Generation jobs outlive the browser session, so their cards can be opened again later
+    if settings.BACKGROUND_GENERATION:
+        recent_jobs = job_queue.get_user_jobs(st.session_state.username)
+        if recent_jobs:
+            with st.expander("Recent generations"):
+                for job in recent_jobs:
+                    created = time.strftime("%Y-%m-%d %H:%M", time.localtime(job["created_at"]))
+                    if st.button(f"{created}: {job['status']}, {len(job['cards'])} cards", key=f"job_{job['id']}",
+                                 use_container_width=True, disabled=job["id"] == st.session_state.get("active_job_id")):
+                        st.session_state.active_job_id = job["id"]
+                        st.session_state.review_mode = False
+                        st.session_state.quiz = None
+                        st.rerun()
+    
+    # Spaced-repetition review of the cards that are due, in all decks or the current one
+    st.divider()
+    due_count = review.count_due(st.session_state.username)
+    if st.button(f"Review due cards ({due_count}{'+' if due_count >= 1000 else ''})", key="review_all",
+                 use_container_width=True, disabled=due_count == 0):
+        st.session_state.review_mode = True
+        st.session_state.review_deck_id = None
+        st.session_state.quiz = None
+        st.session_state.review_queue = []
+        st.session_state.reviewed_count = 0
+        st.session_state.show_answer = False
+        st.rerun()
+    if st.session_state.current_deck_id:
+        if st.button("Review current deck", key="review_deck", use_container_width=True):
+            st.session_state.review_mode = True
+            st.session_state.review_deck_id = st.session_state.current_deck_id
+            st.session_state.quiz = None
+            st.session_state.review_queue = []
+            st.session_state.reviewed_count = 0
+            st.session_state.show_answer = False
+            st.rerun()
+        if st.button("Quiz current deck", key="quiz_deck", use_container_width=True):
+            st.session_state.quiz = quiz.build_quiz(st.session_state.current_deck_id, settings.QUIZ_QUESTIONS)
+            st.session_state.quiz_position = 0
+            st.session_state.quiz_score = 0
+            st.session_state.quiz_checked = None
+            st.session_state.review_mode = False
+            st.rerun()
+    
+    show_metrics = False
+    if st.session_state.username in settings.ADMIN_USERS:
+        st.divider()
+        show_metrics = st.toggle("Performance metrics", key="show_metrics")
+
+# Admin-only view of where time goes in the pipeline
+if show_metrics:
+    st.header("Performance Metrics")
+    window_hours = st.selectbox("Time window", [1, 24, 24 * 7], index=1,
+                                format_func=lambda hours: f"Last {hours} hours" if hours < 168 else "Last 7 days")
+    since = time.time() - window_hours * 3600
+    
+    stage_rows = metrics.stage_summary(since)
+    if stage_rows:
+        st.subheader("Stages")
+        st.caption("Sorted by total time. Token throughput is decoding speed, excluding prompt evaluation where the time to first token is known.")
+        st.dataframe(pd.DataFrame(stage_rows), hide_index=True, use_container_width=True)
+        
+        st.subheader("Slowest operations")
+        slowest = pd.DataFrame(metrics.slowest_operations(since),
+                               columns=["time", "stage", "label", "seconds", "prompt_tokens", "completion_tokens", "error"])
+        slowest["time"] = pd.to_datetime(slowest["time"], unit="s")
+        st.dataframe(slowest, hide_index=True, use_container_width=True)
+    else:
+        st.info("No operations recorded in this time window.")
+    
+    st.download_button("Download Prometheus metrics", metrics.prometheus_text(),
+                       file_name="metrics.prom", mime="text/plain")
+    st.stop()
+
+# Review mode: one due card at a time, fetched from the database in small batches
+if st.session_state.get("review_mode"):
+    st.header("Review")
+    if not st.session_state.review_queue:
+        st.session_state.review_queue = review.next_due_cards(st.session_state.username,
+                                                              deck_id=st.session_state.review_deck_id)
+    
+    if st.session_state.review_queue:
+        card = st.session_state.review_queue[0]
+        heading = "New card" if card["repetitions"] == 0 and card["lapses"] == 0 else "Review"
+        st.markdown(flashcard_html(card, 0, 0, st.session_state.show_answer, heading=heading),
+                    unsafe_allow_html=True)
+        
+        if not st.session_state.show_answer:
+            if st.button("Show Answer", use_container_width=True):
+                st.session_state.show_answer = True
+                st.rerun()
+        else:
+            # Grading writes in the background, so the next card shows at once
+            grade_cols = st.columns(len(review.GRADES))
+            for grade_col, (label, quality) in zip(grade_cols, review.GRADES.items()):
+                with grade_col:
+                    if st.button(label, key=f"grade_{quality}", use_container_width=True):
+                        review.grade(card, quality)
+                        st.session_state.review_queue.pop(0)
+                        st.session_state.reviewed_count += 1
+                        st.session_state.show_answer = False
+                        st.rerun()
+        st.caption(f"{st.session_state.reviewed_count} cards reviewed this session")
+    else:
+        st.success(f"No more cards are due. You reviewed {st.session_state.reviewed_count} cards.")
+    
+    if st.button("End Review"):
+        st.session_state.review_mode = False
+        st.session_state.review_queue = []
+        st.session_state.show_answer = False
+        st.rerun()
+    st.stop()
+
+# Quiz mode: multiple-choice questions built from the current deck
+if st.session_state.get("quiz"):
+    st.header("Quiz")
+    questions = st.session_state.quiz
+    position = st.session_state.quiz_position
+    
+    if position < len(questions):
+        question = questions[position]
+        st.subheader(f"Question {position + 1}/{len(questions)}")
+        st.write(question["question"])
+        choice = st.radio("Your answer", range(len(question["choices"])), index=None,
+                          format_func=lambda index: question["choices"][index], key=f"quiz_choice_{position}",
+                          disabled=st.session_state.quiz_checked is not None)
+        
+        if st.session_state.quiz_checked is None:
+            if st.button("Check Answer", disabled=choice is None):
+                st.session_state.quiz_checked = choice
+                st.session_state.quiz_score += choice == question["answer"]
+                st.rerun()
+        else:
+            if st.session_state.quiz_checked == question["answer"]:
+                st.success("Correct!")
+            else:
+                st.error(f"The answer is: {question['choices'][question['answer']]}")
+            if st.button("Next Question"):
+                st.session_state.quiz_position += 1
+                st.session_state.quiz_checked = None
+                st.rerun()
+        st.caption(f"Score: {st.session_state.quiz_score}/{position + (st.session_state.quiz_checked is not None)}")
+    else:
+        st.success(f"Quiz finished: {st.session_state.quiz_score} of {len(questions)} correct.")
+    
+    if st.button("End Quiz"):
+        st.session_state.quiz = None
+        st.rerun()
+    st.stop()
+
+# Full-text search over all of the user's flashcards
+card_search = st.text_input("Search your flashcards", key="card_search",
+                            placeholder="Words from a question or answer")
+if card_search != st.session_state.get("last_card_search", ""):
+    st.session_state.last_card_search = card_search
+    st.session_state.card_search_page = 0
+if card_search:
+    search_page = st.session_state.get("card_search_page", 0)
+    results, result_count = search_flashcards(st.session_state.username, card_search, search_page,
+                                              settings.SEARCH_RESULTS_PER_PAGE)
+    if result_count:
+        st.caption(f"{result_count} matching flashcards")
+        for card_id, deck_id, deck_name, position, question, answer in results:
+            result_col, open_col = st.columns([5, 1])
+            with result_col:
+                st.markdown(f"**{deck_name}**, card {position + 1}  \nQ: {question}  \nA: {answer}")
+            with open_col:
+                # Jump to the card in its deck
+                if st.button("Open", key=f"search_result_{card_id}", use_container_width=True):
+                    st.session_state.current_deck_id = deck_id
+                    st.session_state.flashcards = get_deck_flashcards(deck_id)
+                    st.session_state.current_flashcard = position
+                    st.session_state.show_answer = False
+                    st.rerun()
+        
+        search_page_count = -(-result_count // settings.SEARCH_RESULTS_PER_PAGE)
+        if search_page_count > 1:
+            prev_col, page_col, next_col = st.columns([1, 4, 1])
+            with prev_col:
+                if st.button("<", key="search_page_prev", disabled=search_page == 0):
+                    st.session_state.card_search_page = search_page - 1
+                    st.rerun()
+            with page_col:
+                st.caption(f"Page {search_page + 1} of {search_page_count}")
+            with next_col:
+                if st.button(">", key="search_page_next", disabled=search_page >= search_page_count - 1):
+                    st.session_state.card_search_page = search_page + 1
+                    st.rerun()
+    else:
+        st.info("No flashcards match your search.")
 
 # File uploader to choose documents
 uploaded_files = st.file_uploader("Choose one or more files", type=["jpg", "jpeg", "png", "pdf", "txt"], accept_multiple_files=True)
 
 all_text = ""
+processing_time = 0.0
 
 # Process uploaded files
 if uploaded_files: 
+    processing_start_time = time.perf_counter()
+    extracted_texts = st.session_state.extracted_texts
+    
+    # Forget files that are no longer uploaded so the memo stays bounded
+    for file_id in set(extracted_texts) - {f.file_id for f in uploaded_files}:
+        del extracted_texts[file_id]
+    
+    # OCR all new images as one batch so they are processed in parallel
+    image_files = [f for f in uploaded_files
+                   if f.type.startswith("image") and f.file_id not in extracted_texts]
+    if image_files:
+        with metrics.timer("extract", f"{len(image_files)} images"):
+            extracted_texts.update(zip([f.file_id for f in image_files],
+                                       ocr_images([f.getvalue() for f in image_files])))
+    
     for uploaded_file in uploaded_files:
         filename = uploaded_file.name
         st.subheader(f"Processing file: {filename}")
         
-        # Extract text based on file type
         if uploaded_file.type.startswith("image"):
             st.image(uploaded_file, caption="Uploaded Image", use_container_width=True)
-            img = Image.open(uploaded_file)
-            extracted_text = pytesseract.image_to_string(img)
+        
+        # Extract text based on file type, once per upload
+        if uploaded_file.file_id in extracted_texts:
+            extracted_text = extracted_texts[uploaded_file.file_id]
             
         elif uploaded_file.type == "application/pdf":
-            pdf_bytes = uploaded_file.read()
-            pdf_file = io.BytesIO(pdf_bytes)
-            pdf_reader = pdfread.PdfReader(pdf_file)
-            
-            extracted_text = ""
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                extracted_text += page.extract_text()
+            with metrics.timer("extract", filename):
+                extracted_text = extract_pdf_text(uploaded_file.getvalue())
                 
         elif uploaded_file.type == "text/plain":
-            extracted_text = uploaded_file.read().decode("utf-8")
+            with metrics.timer("extract", filename):
+                extracted_text = uploaded_file.getvalue().decode("utf-8")
             
         else:
             st.error(f"Error processing {filename}: Unsupported file type")
             continue
         
-        all_text += f"\n\n--- Text from {filename} ---\n\n{extracted_text}"
+        extracted_texts[uploaded_file.file_id] = extracted_text
+        all_text += f"\n\n{document_header(filename)}\n\n{extracted_text}"
+    
+    processing_time = time.perf_counter() - processing_start_time
     
     # Show raw extracted text in expandable container
     # with st.expander("View Raw Extracted Text", expanded=False):
@@ -496,10 +652,48 @@ if uploaded_files:
     
     # Generate flashcards from extracted text
     if st.button("Generate Flashcards"):
-        with st.spinner("Generating flashcards with AI..."):
-            llm = load_llm()
+        if settings.BACKGROUND_GENERATION:
+            # Queue the work; the page stays usable while a background worker generates
+            st.session_state.active_job_id = job_queue.submit_job(st.session_state.username, all_text)
+            st.rerun()
+        
+        llm = load_llm()
+        
+        # Streaming decodes in this process; a worker pool returns the cards at the end instead
+        if settings.STREAM_FLASHCARDS and settings.LLM_WORKERS <= 1:
+            st.session_state.flashcards = []
+            st.session_state.current_flashcard = 0
+            st.session_state.show_answer = False
+            st.session_state.current_deck_id = None  # Reset current deck ID
             
-            flashcards = generate_flashcards(all_text, llm)
+            # Show every card as soon as the model has written it
+            progress_bar = st.progress(0)
+            stream_status = st.empty()
+            card_preview = st.empty()
+            start_time = time.perf_counter()
+            first_card_time = None
+            for card in llm_engine.stream_flashcards(
+                    all_text, llm,
+                    progress_callback=lambda done, total: progress_bar.progress(done / total),
+                    warning_callback=st.warning):
+                if first_card_time is None:
+                    first_card_time = time.perf_counter() - start_time
+                st.session_state.flashcards.append(card)
+                card_count = len(st.session_state.flashcards)
+                stream_status.caption(f"{card_count} flashcards so far (first card after {first_card_time:.1f}s)")
+                card_preview.markdown(flashcard_html(card, card_count - 1, card_count, False),
+                                      unsafe_allow_html=True)
+            card_preview.empty()
+            flashcards = st.session_state.flashcards
+            
+            if flashcards:
+                st.caption(f"First card after {first_card_time:.1f}s, "
+                           f"last card after {time.perf_counter() - start_time:.1f}s")
+            else:
+                st.session_state.flashcards = None
+        else:
+            with st.spinner("Generating flashcards with AI..."):
+                flashcards = generate_flashcards(all_text, llm)
             
             # Save flashcards in session state
             if flashcards:
@@ -507,10 +701,68 @@ if uploaded_files:
                 st.session_state.current_flashcard = 0
                 st.session_state.show_answer = False
                 st.session_state.current_deck_id = None  # Reset current deck ID
-                
-                st.success(f"Generated {len(flashcards)} flashcards!")
-            else:
-                st.error("No flashcards could be generated from the text.")
+        
+        if flashcards:
+            st.success(f"Generated {len(flashcards)} flashcards!")
+            cache_stats = llm_engine.prefix_cache_stats()
+            st.caption(f"Prompt prefix cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+            cache_stats = generation_cache.cache_stats()
+            st.caption(f"Generation cache: {cache_stats['hits']} chunks reused, {cache_stats['misses']} generated")
+        else:
+            st.error("No flashcards could be generated from the text.")
+
+# Show the status of a background generation job
+def show_job(job):
+    queue_info = job_queue.queue_stats()
+    st.caption(f"Generation queue: {queue_info['queued']} waiting, {queue_info['running']} running, "
+               f"average wait {queue_info['average_wait']:.0f}s")
+    
+    if job["status"] == "queued":
+        st.info(f"Your flashcards are queued (waiting {time.time() - job['created_at']:.0f}s). "
+                "You can keep studying in the meantime.")
+    elif job["status"] == "running":
+        if job["chunks_total"]:
+            st.progress(job["chunks_done"] / job["chunks_total"])
+        st.info(f"Generating flashcards: {len(job['cards'])} so far. You can keep studying in the meantime.")
+    elif job["status"] == "done":
+        st.success(f"Generated {len(job['cards'])} flashcards!")
+    else:
+        st.error(f"No flashcards could be generated from the text. {job['error'] or ''}")
+        st.session_state.active_job_id = None
+    
+    if job["cards"] and st.button("Study Generated Flashcards"):
+        st.session_state.flashcards = job["cards"]
+        st.session_state.current_flashcard = 0
+        st.session_state.show_answer = False
+        st.session_state.current_deck_id = None  # Reset current deck ID
+        if job["status"] == "done":
+            st.session_state.active_job_id = None
+        st.rerun()
+
+# Poll an unfinished job by re-running only this part of the page, so studying isn't held up
+@st.fragment(run_every=settings.JOB_POLL_SECONDS)
+def show_unfinished_job(job_id):
+    job = job_queue.get_job(job_id)
+    if not job or job["status"] not in ("queued", "running"):
+        st.rerun()  # The whole page shows the finished job
+    show_job(job)
+
+# Show the progress of the user's background generation job
+if settings.BACKGROUND_GENERATION:
+    start_job_worker()
+    if "active_job_id" not in st.session_state:
+        # A new session (e.g. after the browser disconnected) picks up the user's unfinished job
+        unfinished = [job for job in job_queue.get_user_jobs(st.session_state.username)
+                      if job["status"] in ("queued", "running")]
+        st.session_state.active_job_id = unfinished[0]["id"] if unfinished else None
+    active_job = None
+    if st.session_state.get("active_job_id"):
+        active_job = job_queue.get_job(st.session_state.active_job_id)
+    
+    if active_job and active_job["status"] in ("queued", "running"):
+        show_unfinished_job(active_job["id"])
+    elif active_job:
+        show_job(active_job)
 
 # Display and interact with flashcards
 if 'flashcards' in st.session_state and st.session_state.flashcards:
@@ -518,16 +770,44 @@ if 'flashcards' in st.session_state and st.session_state.flashcards:
     
     # Save deck option
     if st.session_state.current_deck_id is None:  # Only show save option for newly generated decks
+        user_decks = list_user_decks(st.session_state.username)
+        save_mode = "New deck"
+        if user_decks:
+            save_mode = st.radio("Save to", ["New deck", "Existing deck"], horizontal=True)
         col1, col2 = st.columns([3, 1])
         with col1:
-            deck_name = st.text_input("Deck Name", value=st.session_state.deck_name, 
-                                     placeholder="Enter a name for this deck")
+            if save_mode == "New deck":
+                deck_name = st.text_input("Deck Name", value=st.session_state.deck_name, 
+                                         placeholder="Enter a name for this deck")
+            else:
+                target_deck = st.selectbox("Deck", user_decks,
+                                           format_func=lambda deck: f"{deck[1]} ({deck[3]} cards)")
         with col2:
             if st.button("Save Deck", use_container_width=True):
-                if deck_name:
-                    deck_id = save_deck(st.session_state.username, deck_name, st.session_state.flashcards)
+                if save_mode == "Existing deck":
+                    # Leave out cards that repeat each other or the cards already in the deck
+                    cards = st.session_state.flashcards
+                    if settings.DEDUPE_CARDS:
+                        cards = dedupe.dedupe_cards(cards, get_deck_flashcards(target_deck[0]))
+                    add_cards_to_deck(target_deck[0], cards)
+                    removed = len(st.session_state.flashcards) - len(cards)
+                    st.session_state.flashcards = get_deck_flashcards(target_deck[0])
+                    st.session_state.current_flashcard = 0
+                    st.session_state.show_answer = False
+                    st.session_state.current_deck_id = target_deck[0]
+                    st.toast(f"Added {len(cards)} flashcards to '{target_deck[1]}' ({removed} duplicates left out)")
+                    st.rerun()
+                elif deck_name:
+                    cards = st.session_state.flashcards
+                    if settings.DEDUPE_CARDS:
+                        cards = dedupe.dedupe_cards(cards)
+                    deck_id = save_deck(st.session_state.username, deck_name, cards)
+                    removed = len(st.session_state.flashcards) - len(cards)
+                    st.session_state.flashcards = cards
+                    st.session_state.current_flashcard = 0
+                    st.session_state.show_answer = False
                     st.session_state.current_deck_id = deck_id  # Set the current deck ID to the newly saved deck
-                    st.success(f"Deck '{deck_name}' saved successfully!")
+                    st.toast(f"Deck '{deck_name}' saved with {len(cards)} flashcards ({removed} duplicates left out)")
                     st.session_state.deck_name = ""  # Reset deck name
                     st.rerun()
                 else:
@@ -542,24 +822,8 @@ if 'flashcards' in st.session_state and st.session_state.flashcards:
     
     # Flashcard HTML with animation
     with flashcard_container:
-        st.markdown(f"""
-        <div class="flashcard-container">
-            <div class="flashcard {'flipped' if st.session_state.show_answer else ''}" id="flashcard">
-                <div class="flashcard-front">
-                    <div class="flashcard-content">
-                        <h3>Question {current_idx + 1}/{len(st.session_state.flashcards)}</h3>
-                        <p>{current_flashcard["question"]}</p>
-                    </div>
-                </div>
-                <div class="flashcard-back">
-                    <div class="flashcard-content">
-                        <h3>Answer</h3>
-                        <p>{current_flashcard["answer"]}</p>
-                    </div>
-                </div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(flashcard_html(current_flashcard, current_idx, len(st.session_state.flashcards),
+                                   st.session_state.show_answer), unsafe_allow_html=True)
     
     # Flashcard controls
     col1, col2, col3 = st.columns(3)
@@ -594,6 +858,11 @@ if 'flashcards' in st.session_state and st.session_state.flashcards:
 if st.button("Logout"):
     st.session_state.authenticated = False
     st.session_state.username = ""
+    st.session_state.pop("active_job_id", None)
     st.success("You have been logged out successfully!")
     time.sleep(1)
-    st.rerun()
\ No newline at end of file
+    st.rerun()
+
+# Show what this rerun cost, e.g. to check that flipping a card doesn't reprocess documents
+st.caption(f"Page updated in {(time.perf_counter() - run_start_time) * 1000:.0f} ms "
+           f"(document processing {processing_time * 1000:.0f} ms)")
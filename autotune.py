@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import platform
+import time
+from llama_cpp import Llama
+import database
+import generation_cache
+import settings
+
+# Hardware-aware tuning of the llama.cpp runtime parameters. A short calibration measures
+# prompt evaluation and decoding throughput for candidate values of n_threads, n_threads_batch,
+# n_batch, use_mmap and use_mlock, one parameter at a time, and the best profile is stored per
+# host and model file in the llama_profiles table. Parameters set explicitly in the
+# environment always win over the profile.
+#
+#     python autotune.py          (calibrate now and print the trials)
+#     python autotune.py --force  (calibrate again even if a profile exists)
+
+# Text evaluated during calibration; repeated until it fills CALIBRATION_PROMPT_TOKENS
+CALIBRATION_TEXT = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose. The light "
+    "reactions take place in the thylakoid membranes and produce ATP and NADPH, which the "
+    "Calvin cycle in the stroma uses to fix carbon dioxide into sugars. "
+)
+CALIBRATION_PROMPT_TOKENS = 512
+CALIBRATION_DECODE_TOKENS = 32
+
+# Environment variable that overrides each tuned parameter
+OVERRIDES = {
+    "n_threads": "N_THREADS",
+    "n_threads_batch": "N_THREADS_BATCH",
+    "n_batch": "N_BATCH",
+    "use_mmap": "USE_MMAP",
+    "use_mlock": "USE_MLOCK",
+}
+
+# Function to get the runtime parameters from the settings, without any profile
+def default_params():
+    return {
+        "n_threads": settings.N_THREADS,
+        "n_threads_batch": settings.N_THREADS_BATCH or settings.N_THREADS,
+        "n_batch": settings.N_BATCH,
+        "use_mmap": bool(settings.USE_MMAP),
+        "use_mlock": bool(settings.USE_MLOCK),
+    }
+
+# Identify this machine and model file; a profile is only valid for both
+def _profile_key(model_path):
+    return platform.node(), generation_cache.model_fingerprint(model_path)
+
+# Function to get the stored profile for this host and model, or None
+def get_profile(model_path=None):
+    host, model = _profile_key(model_path or settings.MODEL_PATH)
+    with database.connection() as conn:
+        row = conn.execute("SELECT params FROM llama_profiles WHERE host = ? AND model = ?",
+                           (host, model)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def _save_profile(model_path, params, trial):
+    host, model = _profile_key(model_path)
+    with database.connection() as conn:
+        conn.execute('''INSERT OR REPLACE INTO llama_profiles
+                        (host, model, params, prompt_tokens_per_second, decode_tokens_per_second, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (host, model, json.dumps(params), trial["prompt_tokens_per_second"],
+                      trial["decode_tokens_per_second"], time.strftime("%Y-%m-%d %H:%M:%S")))
+
+# Load the model with one set of parameters and measure its throughput
+def _measure(model_path, params):
+    start = time.perf_counter()
+    llm = Llama(model_path=model_path, n_ctx=settings.N_CTX, n_gpu_layers=settings.N_GPU_LAYERS,
+                verbose=False, **params)
+    load_seconds = time.perf_counter() - start
+
+    tokens = []
+    while len(tokens) < CALIBRATION_PROMPT_TOKENS + CALIBRATION_DECODE_TOKENS:
+        tokens += llm.tokenize(CALIBRATION_TEXT.encode("utf-8"), add_bos=False)
+    prompt_tokens = tokens[:CALIBRATION_PROMPT_TOKENS]
+    decode_tokens = tokens[CALIBRATION_PROMPT_TOKENS:CALIBRATION_PROMPT_TOKENS + CALIBRATION_DECODE_TOKENS]
+
+    llm.reset()
+    start = time.perf_counter()
+    llm.eval(prompt_tokens)
+    prompt_seconds = time.perf_counter() - start
+
+    # Decoding evaluates one token per step
+    start = time.perf_counter()
+    for token in decode_tokens:
+        llm.eval([token])
+    decode_seconds = time.perf_counter() - start
+    del llm
+
+    prompt_tps = len(prompt_tokens) / prompt_seconds
+    decode_tps = len(decode_tokens) / decode_seconds
+    return {
+        "params": dict(params),
+        "load_seconds": load_seconds,
+        "prompt_tokens_per_second": prompt_tps,
+        "decode_tokens_per_second": decode_tps,
+        # Estimated time for one chunk that fills the context window and an average-length answer
+        "seconds_per_chunk": ((settings.N_CTX - settings.MAX_TOKENS) / prompt_tps
+                              + (settings.MAX_TOKENS / 2) / decode_tps),
+    }
+
+# Candidate thread counts for this machine's cores
+def _thread_candidates(cores):
+    candidates = {max(1, cores // 4), max(1, cores // 2), max(1, cores * 3 // 4), cores}
+    if cores >= 8:
+        candidates.add(8)
+    return sorted(candidates)
+
+# Function to run the calibration and store the best profile. Each parameter is tuned in
+# turn while the others keep their best value so far. Returns the profile and every trial.
+def calibrate(model_path=None, progress_callback=None):
+    model_path = model_path or settings.MODEL_PATH
+    cores = os.cpu_count() or 1
+    threads = _thread_candidates(cores)
+    searches = [
+        ("n_threads", threads),
+        ("n_threads_batch", threads),
+        ("n_batch", [n_batch for n_batch in (128, 256, 512, 1024) if n_batch <= settings.N_CTX]),
+        ("use_mmap", [True, False]),
+        ("use_mlock", [False, True]),
+    ]
+
+    best = default_params()
+    best["n_threads"] = best["n_threads_batch"] = min(best["n_threads"], cores)
+    trials = []
+    best_trial = None
+    for name, candidates in searches:
+        for value in candidates:
+            params = dict(best, **{name: value})
+            # n_threads is tuned first with prompt evaluation on the same threads
+            if name == "n_threads":
+                params["n_threads_batch"] = value
+            if best_trial is not None and params == best_trial["params"]:
+                continue
+            trial = _measure(model_path, params)
+            trials.append(trial)
+            if progress_callback:
+                progress_callback(trial)
+            if best_trial is None or trial["seconds_per_chunk"] < best_trial["seconds_per_chunk"]:
+                best_trial = trial
+        best = dict(best_trial["params"])
+
+    _save_profile(model_path, best, best_trial)
+    return best, trials
+
+# Function to get the parameters load_model should use: the settings, replaced by the
+# host's tuned profile when auto-tuning is on (calibrating first if there is none yet),
+# with explicitly set environment variables taking precedence
+def runtime_params(model_path=None):
+    params = default_params()
+    if settings.AUTO_TUNE:
+        profile = get_profile(model_path)
+        if profile is None:
+            profile, _ = calibrate(model_path)
+        for name, value in profile.items():
+            if os.environ.get(OVERRIDES[name], "").strip() == "":
+                params[name] = value
+    return params
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the llama.cpp runtime parameters for this machine")
+    parser.add_argument("--force", action="store_true", help="Calibrate even if a profile exists")
+    args = parser.parse_args()
+
+    database.init_db()
+    profile = get_profile()
+    if profile is None or args.force:
+        print(f"{'n_threads':>9} {'batch_thr':>9} {'n_batch':>7} {'mmap':>5} {'mlock':>5} "
+              f"{'load s':>7} {'prompt t/s':>10} {'decode t/s':>10} {'s/chunk':>8}")
+
+        def show(trial):
+            params = trial["params"]
+            print(f"{params['n_threads']:>9} {params['n_threads_batch']:>9} {params['n_batch']:>7} "
+                  f"{params['use_mmap']!s:>5} {params['use_mlock']!s:>5} {trial['load_seconds']:>7.1f} "
+                  f"{trial['prompt_tokens_per_second']:>10.1f} {trial['decode_tokens_per_second']:>10.1f} "
+                  f"{trial['seconds_per_chunk']:>8.1f}")
+        profile, _ = calibrate(progress_callback=show)
+    print(f"Profile for {platform.node()}: {json.dumps(profile)}")
+
+if __name__ == "__main__":
+    main()
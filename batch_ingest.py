@@ -0,0 +1,143 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import database
+import dedupe
+import extraction
+import llm_engine
+import metrics
+import settings
+
+# Headless batch ingestion: turn every document under a directory into a flashcard deck.
+# Uses the same extraction, generation and database code as the app, without Streamlit.
+#
+#     python batch_ingest.py path/to/course --username demo
+#
+# Progress is recorded per file in the ingest_status table; running the same command
+# again after an interruption skips the files that are already done.
+
+# Function to find every supported document under a directory, in a stable order
+def find_documents(root):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extraction.SUPPORTED_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+# Read and extract one document; runs on the extraction threads
+def _extract(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    content_hash = extraction.document_hash(data)
+    try:
+        with metrics.timer("extract", os.path.basename(path)):
+            text = extraction.extract_document(os.path.basename(path), data)
+        return path, content_hash, text, None
+    except Exception as e:
+        return path, content_hash, None, f"Extraction failed: {e}"
+
+# Function to generate flashcards for one extracted document and build its ingest result
+def ingest_document(llm, root, path, content_hash, text, error):
+    relative_path = os.path.relpath(path, root)
+    flashcards = []
+    if error is None:
+        warnings = []
+        try:
+            flashcards = llm_engine.generate_flashcards(text, llm, warning_callback=warnings.append)
+            if settings.DEDUPE_CARDS:
+                flashcards = dedupe.dedupe_cards(flashcards)
+        except Exception as e:
+            error = f"Generation failed: {e}"
+        for warning in warnings:
+            print(f"  {relative_path}: {warning}", file=sys.stderr)
+    return {
+        "path": os.path.abspath(path),
+        "content_hash": content_hash,
+        "deck_name": os.path.splitext(relative_path)[0],
+        "flashcards": flashcards,
+        "error": error,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate flashcard decks for every document in a directory")
+    parser.add_argument("directory", help="Directory to walk for PDF, image and text files")
+    parser.add_argument("--username", required=True, help="User the decks are saved for")
+    parser.add_argument("--extract-workers", type=int, default=4,
+                        help="Documents extracted concurrently while the model generates")
+    parser.add_argument("--batch-size", type=int, default=20,
+                        help="Documents whose decks are written in one transaction")
+    parser.add_argument("--retry-failed", action="store_true", help="Process files that failed before")
+    args = parser.parse_args()
+
+    database.init_db()
+    statuses = database.get_ingest_statuses()
+
+    # Skip documents that are already done and haven't changed since
+    todo = []
+    for path in find_documents(args.directory):
+        content_hash, status = statuses.get(os.path.abspath(path), (None, None))
+        if status == "done" or (status == "failed" and not args.retry_failed):
+            with open(path, "rb") as f:
+                if extraction.document_hash(f.read()) == content_hash:
+                    continue
+        todo.append(path)
+    print(f"{len(todo)} documents to process")
+    if not todo:
+        return
+
+    llm = llm_engine.load_model()
+    start_time = time.perf_counter()
+    processed = 0
+    failed = 0
+    batch = []
+
+    # Extraction runs a few documents ahead on a thread pool while the model works through
+    # them in order; generation itself is spread over the LLM worker pool (LLM_WORKERS)
+    with ThreadPoolExecutor(max_workers=args.extract_workers) as pool:
+        remaining = iter(todo)
+        extracting = deque()
+
+        def extract_next():
+            path = next(remaining, None)
+            if path is not None:
+                extracting.append(pool.submit(_extract, path))
+
+        for _ in range(args.extract_workers * 2):
+            extract_next()
+
+        while extracting:
+            path, content_hash, text, error = extracting.popleft().result()
+            extract_next()
+            result = ingest_document(llm, args.directory, path, content_hash, text, error)
+            batch.append(result)
+            processed += 1
+            if result["error"]:
+                failed += 1
+                print(f"[{processed}/{len(todo)}] {path}: {result['error']}", file=sys.stderr)
+            else:
+                print(f"[{processed}/{len(todo)}] {path}: {len(result['flashcards'])} flashcards")
+
+            if len(batch) >= args.batch_size:
+                database.save_ingest_batch(args.username, batch)
+                batch = []
+
+    if batch:
+        database.save_ingest_batch(args.username, batch)
+
+    elapsed = time.perf_counter() - start_time
+    usage = llm_engine.token_usage()
+    print(f"Processed {processed} documents ({failed} failed) in {elapsed:.0f}s: "
+          f"{processed / elapsed * 3600:.1f} documents/hour")
+    print(f"LLM tokens: {usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion = "
+          f"{usage['prompt_tokens'] + usage['completion_tokens']}")
+
+    llm_engine.shutdown_worker_pool()
+    extraction.shutdown_extraction_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import time
+import llm_engine
+import settings
+from benchmarks.bench_workers import sample_text
+
+# Free sampling versus grammar-constrained decoding on the same chunks: parse-failure rate,
+# average completion length, cards and time per chunk. Run from the project root with the model in place:
+#     python -m benchmarks.bench_grammar --input notes.txt
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grammar-constrained JSON decoding")
+    parser.add_argument("--input", help="Text file to generate from (default: synthetic notes)")
+    parser.add_argument("--paragraphs", type=int, default=60,
+                        help="Size of the synthetic notes when no input file is given")
+    parser.add_argument("--max-chunks", type=int, default=8, help="Chunks generated per mode")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sample_text(args.paragraphs)
+
+    llm = llm_engine.load_model()
+    chunks = llm_engine.split_into_chunks(text, llm)[:args.max_chunks]
+    print(f"{len(chunks)} chunks")
+    print(f"{'mode':>8} {'failed':>7} {'tokens/chunk':>13} {'cards/chunk':>12} {'s/chunk':>8}")
+
+    for mode, grammar in (("free", 0), ("grammar", 1)):
+        settings.GRAMMAR_DECODING = grammar
+        failed = 0
+        completion_tokens = 0
+        cards = 0
+        start = time.perf_counter()
+        for chunk in chunks:
+            output = llm_engine.complete_chunk(llm, chunk)
+            completion_tokens += output["usage"]["completion_tokens"]
+            try:
+                chunk_cards = llm_engine.parse_flashcards(output["choices"][0]["text"])
+            except ValueError:
+                chunk_cards = []
+            failed += not chunk_cards
+            cards += len(chunk_cards)
+        elapsed = time.perf_counter() - start
+        print(f"{mode:>8} {failed / len(chunks):>7.0%} {completion_tokens / len(chunks):>13.0f} "
+              f"{cards / len(chunks):>12.1f} {elapsed / len(chunks):>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import time
+import settings
+
+# Throughput of PDF text extraction in pages per second: serial, parallel, and from the page cache.
+# Run from the project root:
+#     python -m benchmarks.bench_pdf --pages 500
+
+LINE = "Osmosis is the diffusion of water across a selectively permeable membrane."
+
+# Function to build a text-only PDF with the given number of pages
+def make_pdf(pages, lines_per_page=40):
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page_num in range(pages):
+        text_ops = ["BT /F1 10 Tf 12 TL 50 780 Td"]
+        for line_num in range(lines_per_page):
+            text_ops.append(f"({LINE} Page {page_num + 1}, line {line_num + 1}.) '")
+        text_ops.append("ET")
+        stream = "\n".join(text_ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    parts = [b"%PDF-1.4\n"]
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(sum(len(part) for part in parts))
+        parts.append(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref_offset = sum(len(part) for part in parts)
+    parts.append(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    parts.extend(b"%010d 00000 n \n" % offset for offset in offsets)
+    parts.append(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                 % (len(objects) + 1, xref_offset))
+    return b"".join(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF text extraction")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    # Keep the benchmark's page cache out of the real database
+    settings.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    import database
+    import extraction
+    database.init_db()
+
+    pdf_bytes = make_pdf(args.pages)
+    # Start the pool up front: the app keeps it running between uploads
+    extraction.get_extraction_pool(args.workers).submit(len, "").result()
+    runs = [
+        ("serial", 1, b""),
+        (f"{args.workers} workers", args.workers, b"\n% parallel run"),
+        ("page cache", args.workers, b"\n% parallel run"),
+    ]
+    print(f"{'run':>12} {'seconds':>9} {'pages/s':>9}")
+    for name, workers, salt in runs:
+        # A trailing comment changes the document hash so each uncached run starts cold
+        start = time.perf_counter()
+        pages = list(extraction.iter_pdf_pages(pdf_bytes + salt, workers=workers))
+        elapsed = time.perf_counter() - start
+        assert len(pages) == args.pages
+        print(f"{name:>12} {elapsed:>9.2f} {len(pages) / elapsed:>9.0f}")
+
+    extraction.shutdown_extraction_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import pytesseract
+import settings
+
+# Offline benchmark of every pipeline stage, timed separately: extraction (text, PDF and
+# image corpora), optimize_text, chunking, filter, generation, parsing, dedupe, save_deck,
+# get_deck_flashcards, search_flashcards, quiz and review. The model is replaced by
+# benchmarks.stub_llm, so no GGUF file or Streamlit is needed. Results are written as JSON
+# so runs on different commits can be compared.
+# Run from the project root:
+#     python -m benchmarks.bench_pipeline --output before.json
+#     python -m benchmarks.bench_pipeline --output after.json --compare before.json
+
+WORDS = ("cell membrane protein energy enzyme gradient diffusion osmosis molecule receptor "
+         "transport channel carrier glucose oxygen mitochondria nucleus ribosome synthesis "
+         "signal pathway hormone neuron voltage potential equilibrium concentration solute").split()
+
+# Function to build deterministic lecture-note style text with headers, paragraphs and short lines
+def lecture_notes(documents, paragraphs, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    for doc_num in range(documents):
+        parts.append(f"--- Text from notes_{doc_num + 1}.pdf ---")
+        for paragraph_num in range(paragraphs):
+            if paragraph_num % 10 == 0:
+                parts.append(f"Lecture {doc_num + 1}.{paragraph_num // 10 + 1}\n")
+            sentences = []
+            for _ in range(rng.randint(3, 7)):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(8, 24))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            parts.append("  ".join(sentences) + "\n")
+    return "\n".join(parts)
+
+# Function to render lines of text into a PNG, as a stand-in for a photographed page
+def make_image(lines):
+    from PIL import Image, ImageDraw
+    img = Image.new("L", (1700, 60 + 40 * len(lines)), 255)
+    draw = ImageDraw.Draw(img)
+    for line_num, line in enumerate(lines):
+        draw.text((60, 30 + 40 * line_num), line, fill=0)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", dpi=(300, 300))
+    return buffer.getvalue()
+
+# Run fn `repeat` times and summarize the wall-clock times; fn returns the number of items processed
+def time_stage(fn, repeat, unit):
+    times = []
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = fn()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {
+        "seconds": median,
+        "min_seconds": min(times),
+        "items": items,
+        "unit": unit,
+        "per_second": items / median if median > 0 else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage with a stub LLM")
+    parser.add_argument("--documents", type=int, default=4, help="Documents in the synthetic text corpus")
+    parser.add_argument("--paragraphs", type=int, default=100, help="Paragraphs per synthetic document")
+    parser.add_argument("--pages", type=int, default=100, help="Pages of the synthetic PDF")
+    parser.add_argument("--images", type=int, default=4, help="Images in the OCR corpus (0 to skip)")
+    parser.add_argument("--deck-cards", type=int, default=10000, help="Cards in the deck saved and loaded")
+    parser.add_argument("--review-cards", type=int, default=1000, help="Cards graded in the review stage")
+    parser.add_argument("--cards-per-chunk", type=int, default=7)
+    parser.add_argument("--prompt-ms", type=float, default=0.0, help="Stub LLM prompt evaluation time per token")
+    parser.add_argument("--decode-ms", type=float, default=0.0, help="Stub LLM decoding time per token")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction workers")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the median is reported")
+    parser.add_argument("--output", default="bench_pipeline.json", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    # Keep the benchmark's decks and caches out of the real database
+    settings.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    import database
+    import dedupe
+    import extraction
+    import quiz
+    import review
+    import llm_engine
+    from benchmarks.bench_pdf import make_pdf
+    from benchmarks.stub_llm import StubLlama
+    from text_processing import (chunk_text, llm_token_counter, optimize_text, split_documents,
+                                 information_score)
+    database.init_db()
+
+    llm = StubLlama(n_ctx=settings.N_CTX, cards_per_chunk=args.cards_per_chunk,
+                    prompt_ms_per_token=args.prompt_ms, decode_ms_per_token=args.decode_ms)
+    text = lecture_notes(args.documents, args.paragraphs)
+    stages = {}
+    counter = [0]
+
+    # A new salt for every run changes the document hash, so no run is served from the page cache
+    def salted(data):
+        counter[0] += 1
+        return data + b"\n%% run %d" % counter[0]
+
+    stages["extract_text"] = time_stage(
+        lambda: len(extraction.extract_document("notes.txt", text.encode("utf-8"))), args.repeat, "chars")
+
+    pdf_bytes = make_pdf(args.pages)
+    stages["extract_pdf"] = time_stage(
+        lambda: len(list(extraction.iter_pdf_pages(salted(pdf_bytes), workers=args.workers))),
+        args.repeat, "pages")
+    stages["extract_pdf_cached"] = time_stage(
+        lambda: len(list(extraction.iter_pdf_pages(pdf_bytes, workers=args.workers))), args.repeat, "pages")
+
+    if args.images:
+        lines = text.splitlines()
+        images = [make_image(lines[i * 20:(i + 1) * 20]) for i in range(args.images)]
+        try:
+            # Tesseract is an external program and may not be installed
+            pytesseract.get_tesseract_version()
+        except Exception as e:
+            stages["extract_images"] = {"skipped": str(e)}
+        else:
+            stages["extract_images"] = time_stage(
+                lambda: len(extraction.ocr_images([salted(image) for image in images], workers=args.workers)),
+                args.repeat, "images")
+
+    documents = split_documents(text)
+    optimized = []
+
+    def optimize_all():
+        optimized[:] = [optimize_text(document) for document in documents]
+        return len(optimized)
+    stages["optimize_text"] = time_stage(optimize_all, args.repeat, "documents")
+
+    count_tokens = llm_token_counter(llm)
+    budget = llm_engine.chunk_token_budget(llm)
+    chunks = []
+
+    def chunk_all():
+        chunks[:] = [chunk for document in optimized
+                     for chunk in chunk_text(document, count_tokens, budget, settings.CHUNK_OVERLAP_TOKENS)]
+        return len(chunks)
+    stages["chunking"] = time_stage(chunk_all, args.repeat, "chunks")
+    chunk_tokens = [count_tokens(chunk) for chunk in chunks]
+    stages["chunking"]["budget_tokens"] = budget
+    stages["chunking"]["mean_fill"] = statistics.mean(chunk_tokens) / budget if chunks else 0.0
+    # Chunk count before the token-budget chunker: 1000-character slices of the whole text
+    # with its whitespace collapsed, one prompt each
+    stages["chunking"]["fixed_slice_chunks"] = -(-len(' '.join(text.split())) // 1000)
+
+    skipped = [0]
+
+    def filter_all():
+        skipped[0] = sum(information_score(chunk)[0] < settings.CHUNK_MIN_INFORMATION for chunk in chunks)
+        return len(chunks)
+    stages["filter"] = time_stage(filter_all, args.repeat, "chunks")
+    stages["filter"]["skipped_chunks"] = skipped[0]
+
+    cards = []
+
+    def generate_all():
+        cards[:] = llm_engine.generate_flashcards(text, llm, workers=1, use_cache=False)
+        return len(cards)
+    stages["generation"] = time_stage(generate_all, args.repeat, "cards")
+    stages["generation"]["chunks"] = len(chunks)
+    # Fill the generation cache first, so every timed run is served from it
+    llm_engine.generate_flashcards(text, llm, workers=1)
+    stages["generation_cached"] = time_stage(
+        lambda: len(llm_engine.generate_flashcards(text, llm, workers=1)), args.repeat, "cards")
+    stages["generation_streamed"] = time_stage(
+        lambda: len(list(llm_engine.stream_flashcards(text, llm, use_cache=False))), args.repeat, "cards")
+
+    completions = [llm.completion_text(llm_engine.build_prompt(chunk)) for chunk in chunks]
+    stages["parsing"] = time_stage(
+        lambda: sum(len(llm_engine.parse_flashcards(completion)) for completion in completions),
+        args.repeat, "cards")
+
+    def parse_streamed():
+        parsed = 0
+        for completion in completions:
+            stream_parser = llm_engine.FlashcardStreamParser()
+            for i in range(0, len(completion), 4):
+                parsed += len(stream_parser.feed(completion[i:i + 4]))
+        return parsed
+    stages["parsing_streamed"] = time_stage(parse_streamed, args.repeat, "cards")
+
+    # Repeat the generated cards up to the requested deck size
+    deck = [cards[i % len(cards)] for i in range(args.deck_cards)] if cards else []
+    deck_ids = []
+    kept = []
+
+    def dedupe_deck():
+        kept[:] = dedupe.dedupe_cards(deck)
+        return len(deck)
+    stages["dedupe"] = time_stage(dedupe_deck, args.repeat, "cards")
+    stages["dedupe"]["kept_cards"] = len(kept)
+
+    def save():
+        deck_ids.append(database.save_deck("bench", "Benchmark deck", deck))
+        return len(deck)
+    stages["save_deck"] = time_stage(save, args.repeat, "cards")
+    stages["get_deck_flashcards"] = time_stage(
+        lambda: len(database.get_deck_flashcards(deck_ids[-1])), args.repeat, "cards")
+    search_words = [word for card in deck[:50] for word in card["question"].split()[2:4]]
+    stages["search_flashcards"] = time_stage(
+        lambda: sum(len(database.search_flashcards("bench", word)[0]) for word in search_words),
+        args.repeat, "results")
+    stages["search_flashcards"]["queries"] = len(search_words)
+
+    # The first quiz builds the deck's answer index; the timed ones use the cached index
+    quiz.deck_index(deck_ids[-1])
+    stages["quiz"] = time_stage(lambda: len(quiz.build_quiz(deck_ids[-1], 50)), args.repeat, "questions")
+
+    # Review the saved decks' cards one at a time, as the study mode does
+    def review_cards():
+        reviewed = 0
+        while reviewed < args.review_cards:
+            due = review.next_due_cards("bench")
+            if not due:
+                break
+            for card in due:
+                review.grade(card, 4)
+                reviewed += 1
+        review.flush()
+        return reviewed
+    stages["review"] = time_stage(review_cards, args.repeat, "cards")
+
+    extraction.shutdown_extraction_pool()
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "usage": llm_engine.token_usage(),
+        "stages": stages,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["stages"]
+
+    print(f"{'stage':>20} {'seconds':>9} {'items':>7} {'per second':>14}" + (f" {'change':>8}" if baseline else ""))
+    for name, stage in stages.items():
+        if "skipped" in stage:
+            print(f"{name:>20} skipped: {stage['skipped']}")
+            continue
+        rate = f"{stage['per_second']:.0f} {stage['unit']}" if stage["per_second"] else "-"
+        line = f"{name:>20} {stage['seconds']:>9.4f} {stage['items']:>7} {rate:>14}"
+        old = baseline.get(name, {})
+        if old.get("seconds"):
+            line += f" {stage['seconds'] / old['seconds'] - 1:>+8.0%}"
+        print(line)
+    chunking = stages["chunking"]
+    print(f"Chunks: {chunking['items']} with the token-budget chunker ({chunking['mean_fill']:.0%} full), "
+          f"{chunking['fixed_slice_chunks']} as fixed 1000-character slices")
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import difflib
+import time
+import llm_engine
+import settings
+from benchmarks.bench_workers import sample_text
+
+# Prompt-lookup speculative decoding versus plain decoding on the same chunks: decode speed
+# and how closely the outputs match. Both models decode greedily (temperature 0), where
+# speculative decoding should reproduce plain decoding's output exactly.
+# Run from the project root with the model in place:
+#     python -m benchmarks.bench_speculative --input notes.txt --draft-tokens 10
+
+# Generate every chunk with one model; returns completions, completion tokens and seconds
+def run(llm, chunks):
+    completions = []
+    completion_tokens = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        output = llm_engine.complete_chunk(llm, chunk)
+        completions.append(output["choices"][0]["text"])
+        completion_tokens += output["usage"]["completion_tokens"]
+    return completions, completion_tokens, time.perf_counter() - start
+
+# The flashcards of a completion, or [] when it doesn't parse
+def cards(completion):
+    try:
+        return llm_engine.parse_flashcards(completion)
+    except ValueError:
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt-lookup speculative decoding")
+    parser.add_argument("--input", help="Text file to generate from (default: synthetic notes)")
+    parser.add_argument("--paragraphs", type=int, default=60,
+                        help="Size of the synthetic notes when no input file is given")
+    parser.add_argument("--max-chunks", type=int, default=8, help="Chunks generated per mode")
+    parser.add_argument("--draft-tokens", type=int, default=None,
+                        help="Tokens drafted per step (default: SPECULATIVE_DRAFT_TOKENS)")
+    args = parser.parse_args()
+
+    if args.draft_tokens:
+        settings.SPECULATIVE_DRAFT_TOKENS = args.draft_tokens
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sample_text(args.paragraphs)
+
+    # Greedy decoding, so differences come from the decoding method and not from sampling
+    llm_engine.SAMPLING_PARAMS["temperature"] = 0.0
+
+    plain_llm = llm_engine.load_model(speculative=False)
+    chunks = llm_engine.split_into_chunks(text, plain_llm)[:args.max_chunks]
+    plain, plain_tokens, plain_seconds = run(plain_llm, chunks)
+    del plain_llm
+
+    speculative_llm = llm_engine.load_model(speculative=True)
+    speculative, speculative_tokens, speculative_seconds = run(speculative_llm, chunks)
+
+    print(f"{len(chunks)} chunks, {settings.SPECULATIVE_DRAFT_TOKENS} draft tokens")
+    print(f"{'mode':>12} {'tokens':>7} {'seconds':>8} {'tokens/s':>9} {'cards':>6}")
+    for mode, completions, tokens, seconds in (("plain", plain, plain_tokens, plain_seconds),
+                                               ("speculative", speculative, speculative_tokens, speculative_seconds)):
+        card_count = sum(len(cards(completion)) for completion in completions)
+        print(f"{mode:>12} {tokens:>7} {seconds:>8.1f} {tokens / seconds:>9.1f} {card_count:>6}")
+    print(f"Speedup: {plain_seconds / speculative_seconds:.2f}x")
+
+    identical = sum(a == b for a, b in zip(plain, speculative))
+    similarity = sum(difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(plain, speculative)) / len(chunks)
+    plain_cards = [card for completion in plain for card in cards(completion)]
+    speculative_cards = [card for completion in speculative for card in cards(completion)]
+    same_cards = sum(card in speculative_cards for card in plain_cards)
+    print(f"Identical completions: {identical}/{len(chunks)}, mean text similarity {similarity:.3f}")
+    print(f"Plain cards also produced by speculative decoding: {same_cards}/{len(plain_cards)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import time
+import autotune
+import llm_engine
+
+# Wall-clock scaling of flashcard generation from 1 to N worker processes (powers of two).
+# Run from the project root with the model in place:
+#     python -m benchmarks.bench_workers --max-workers 8 --input notes.txt
+
+SAMPLE_PARAGRAPH = (
+    "The cell membrane controls what enters and leaves the cell. It is made of a "
+    "phospholipid bilayer with embedded proteins. Small nonpolar molecules diffuse "
+    "through the bilayer directly, while ions and larger polar molecules need "
+    "channel or carrier proteins. Active transport moves substances against their "
+    "concentration gradient and uses energy from ATP."
+)
+
+def sample_text(paragraphs):
+    return "\n\n".join(f"{SAMPLE_PARAGRAPH} (Section {i + 1}.)" for i in range(paragraphs))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Llama worker pool")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--input", help="Text file to generate from (default: synthetic notes)")
+    parser.add_argument("--paragraphs", type=int, default=200,
+                        help="Size of the synthetic notes when no input file is given")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sample_text(args.paragraphs)
+
+    llm = llm_engine.load_model()
+    chunks = len(llm_engine.split_into_chunks(text, llm))
+    print(f"{chunks} chunks")
+    print(f"{'workers':>8} {'threads':>8} {'seconds':>10} {'speedup':>8} {'cards':>6}")
+
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        # Start each run with a fresh pool so model loading is included
+        llm_engine.shutdown_worker_pool()
+        start = time.perf_counter()
+        cards = llm_engine.generate_flashcards(text, llm, workers=workers, use_cache=False)
+        elapsed = time.perf_counter() - start
+
+        baseline = baseline or elapsed
+        # A single worker generates in this process with the app's thread count
+        threads = autotune.runtime_params()["n_threads"] if workers == 1 else llm_engine.threads_per_worker(workers)
+        print(f"{workers:>8} {threads:>8} "
+              f"{elapsed:>10.1f} {baseline / elapsed:>7.2f}x {len(cards):>6}")
+        workers *= 2
+
+    llm_engine.shutdown_worker_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import json
+import re
+import time
+
+# Deterministic stand-in for llama_cpp.Llama, so the pipeline can be benchmarked without
+# the GGUF model. It tokenizes four bytes to a token, answers every prompt with canned
+# flashcard JSON built from the chunk's sentences, and can sleep to imitate the model's
+# prompt evaluation and decoding speed.
+
+SENTENCE = re.compile(r'[^.!?]+[.!?]')
+
+class StubLlama:
+    def __init__(self, n_ctx=4096, cards_per_chunk=7, prompt_ms_per_token=0.0, decode_ms_per_token=0.0,
+                 model_path="stub.gguf"):
+        self.model_path = model_path
+        self.cards_per_chunk = cards_per_chunk
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self._n_ctx = n_ctx
+        self.input_ids = []
+        self.calls = 0
+
+    @property
+    def n_tokens(self):
+        return len(self.input_ids)
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text, add_bos=True, special=False):
+        tokens = [int.from_bytes(text[i:i + 4], "little") for i in range(0, len(text), 4)]
+        return [1] + tokens if add_bos else tokens
+
+    def detokenize(self, tokens):
+        return b"".join(token.to_bytes(4, "little").rstrip(b"\0") for token in tokens if token != 1)
+
+    def reset(self):
+        self.input_ids = []
+
+    def eval(self, tokens):
+        self._sleep(self.prompt_ms_per_token, len(tokens))
+        self.input_ids = self.input_ids + list(tokens)
+
+    def save_state(self):
+        return list(self.input_ids)
+
+    def load_state(self, state):
+        self.input_ids = list(state)
+
+    def _sleep(self, ms_per_token, tokens):
+        if ms_per_token > 0 and tokens > 0:
+            time.sleep(ms_per_token * tokens / 1000)
+
+    # Canned completion: one card per sentence of the chunk text in the prompt
+    def completion_text(self, prompt):
+        chunk = prompt.split("Text to generate flashcards from:", 1)[-1].split("<|end|>", 1)[0]
+        cards = []
+        for sentence in SENTENCE.findall(chunk)[:self.cards_per_chunk]:
+            sentence = " ".join(sentence.split())
+            topic = " ".join(sentence.split()[:4])
+            cards.append({"question": f"What does the text say about {topic}?", "answer": sentence})
+        return "Here are the flashcards:\n" + json.dumps(cards, indent=4)
+
+    def __call__(self, prompt, stream=False, echo=False, max_tokens=16, **kwargs):
+        self.calls += 1
+        # Like llama_cpp.Llama, the prompt is text or a list of tokens
+        if isinstance(prompt, str):
+            prompt_tokens = self.tokenize(prompt.encode("utf-8"), special=True)
+        else:
+            prompt_tokens = list(prompt)
+            prompt = self.detokenize(prompt_tokens).decode("utf-8")
+
+        # Only the tokens after the part already in the KV cache are evaluated
+        shared = 0
+        for cached, token in zip(self.input_ids, prompt_tokens):
+            if cached != token:
+                break
+            shared += 1
+        self.eval(prompt_tokens[shared:])
+        self.input_ids = prompt_tokens
+
+        text = self.completion_text(prompt)
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)][:max_tokens]
+        if stream:
+            return self._stream(pieces)
+        self._sleep(self.decode_ms_per_token, len(pieces))
+        return {
+            "choices": [{"text": "".join(pieces), "index": 0, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt_tokens), "completion_tokens": len(pieces),
+                      "total_tokens": len(prompt_tokens) + len(pieces)},
+        }
+
+    def _stream(self, pieces):
+        for piece in pieces:
+            self._sleep(self.decode_ms_per_token, 1)
+            yield {"choices": [{"text": piece, "index": 0, "finish_reason": None}]}
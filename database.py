@@ -0,0 +1,412 @@
+import collections
+import contextlib
+import datetime
+import json
+import queue
+import re
+import sqlite3 as sql
+import threading
+import metrics
+import settings
+
+# Data-access layer for flashcards.db: pooled connections in WAL mode, the schema and
+# its migrations, and the deck queries used by the app and other entry points
+
+# Idle connections per database file, reused instead of reconnecting for every query
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Per-user deck lists with card counts, invalidated whenever a deck is saved or deleted
+_deck_lists = collections.OrderedDict()
+_deck_lists_lock = threading.Lock()
+
+# Open a connection configured for concurrent readers and one writer
+def _connect(db_path):
+    conn = sql.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+# Borrow a pooled connection. The block runs as one transaction that is committed
+# on success and rolled back on an exception.
+@contextlib.contextmanager
+def connection():
+    db_path = settings.DB_PATH
+    with _pools_lock:
+        pool = _pools.setdefault(db_path, queue.LifoQueue())
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(db_path)
+
+    try:
+        with conn:
+            yield conn
+    finally:
+        if pool.qsize() < settings.DB_POOL_SIZE:
+            pool.put(conn)
+        else:
+            conn.close()
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have run.
+def _migrate_cascade_and_indexes(c):
+    # ON DELETE CASCADE can only be added to an existing table by rebuilding it
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'flashcards'")
+    flashcards_sql = c.fetchone()[0]
+    if "ON DELETE CASCADE" not in flashcards_sql.upper():
+        c.execute('''CREATE TABLE flashcards_migrated
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      deck_id INTEGER,
+                      question TEXT,
+                      answer TEXT,
+                      FOREIGN KEY (deck_id) REFERENCES decks(id) ON DELETE CASCADE)''')
+        c.execute('''INSERT INTO flashcards_migrated (id, deck_id, question, answer)
+                     SELECT id, deck_id, question, answer FROM flashcards''')
+        c.execute("DROP TABLE flashcards")
+        c.execute("ALTER TABLE flashcards_migrated RENAME TO flashcards")
+
+    # decks.username references users, which the app never filled in; with foreign keys
+    # enforced every deck owner needs a users row
+    c.execute("INSERT OR IGNORE INTO users (username) SELECT DISTINCT username FROM decks")
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_decks_username_created ON decks(username, created_date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_flashcards_deck_id ON flashcards(deck_id)")
+
+def _migrate_ingest_status(c):
+    # Per-file progress of batch ingestion runs, so an interrupted run can resume
+    c.execute('''CREATE TABLE IF NOT EXISTS ingest_status
+                 (path TEXT PRIMARY KEY,
+                  content_hash TEXT,
+                  status TEXT,
+                  deck_id INTEGER,
+                  card_count INTEGER,
+                  error TEXT,
+                  updated_at TEXT)''')
+
+def _migrate_jobs(c):
+    # Queue of background flashcard generation jobs; times are Unix timestamps
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  username TEXT,
+                  text TEXT,
+                  status TEXT,
+                  chunks_done INTEGER DEFAULT 0,
+                  chunks_total INTEGER DEFAULT 0,
+                  cards TEXT,
+                  error TEXT,
+                  created_at REAL,
+                  started_at REAL,
+                  finished_at REAL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_username ON jobs(username, id)")
+
+def _migrate_metrics(c):
+    # Timings of individual pipeline operations, and running totals per stage
+    c.execute('''CREATE TABLE IF NOT EXISTS metrics
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  created_at REAL,
+                  stage TEXT,
+                  label TEXT,
+                  seconds REAL,
+                  prompt_tokens INTEGER,
+                  completion_tokens INTEGER,
+                  first_token_seconds REAL,
+                  error TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_created_at ON metrics(created_at)")
+    c.execute('''CREATE TABLE IF NOT EXISTS metrics_totals
+                 (stage TEXT PRIMARY KEY,
+                  calls INTEGER,
+                  errors INTEGER,
+                  seconds REAL,
+                  prompt_tokens INTEGER,
+                  completion_tokens INTEGER)''')
+
+def _migrate_llama_profiles(c):
+    # Tuned llama.cpp runtime parameters per host and model file
+    c.execute('''CREATE TABLE IF NOT EXISTS llama_profiles
+                 (host TEXT,
+                  model TEXT,
+                  params TEXT,
+                  prompt_tokens_per_second REAL,
+                  decode_tokens_per_second REAL,
+                  created_at TEXT,
+                  PRIMARY KEY (host, model))''')
+
+def _migrate_flashcards_fts(c):
+    # Full-text index of every flashcard. The owner column holds one token per user
+    # ('u' and the hex of the username), so a search only reads that user's postings.
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS flashcards_fts
+                 USING fts5(question, answer, owner, deck_id UNINDEXED, tokenize = 'porter unicode61')''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS flashcards_fts_insert AFTER INSERT ON flashcards BEGIN
+                     INSERT INTO flashcards_fts (rowid, question, answer, owner, deck_id)
+                     SELECT new.id, new.question, new.answer, 'u' || hex(username), new.deck_id
+                     FROM decks WHERE id = new.deck_id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS flashcards_fts_delete AFTER DELETE ON flashcards BEGIN
+                     DELETE FROM flashcards_fts WHERE rowid = old.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS flashcards_fts_update AFTER UPDATE ON flashcards BEGIN
+                     DELETE FROM flashcards_fts WHERE rowid = old.id;
+                     INSERT INTO flashcards_fts (rowid, question, answer, owner, deck_id)
+                     SELECT new.id, new.question, new.answer, 'u' || hex(username), new.deck_id
+                     FROM decks WHERE id = new.deck_id;
+                 END''')
+    # Index the cards saved before the table existed
+    c.execute('''INSERT INTO flashcards_fts (rowid, question, answer, owner, deck_id)
+                 SELECT f.id, f.question, f.answer, 'u' || hex(d.username), f.deck_id
+                 FROM flashcards f JOIN decks d ON d.id = f.deck_id''')
+    c.execute("INSERT INTO flashcards_fts (flashcards_fts) VALUES ('optimize')")
+    # Rank matches with BM25, counting questions twice as much as answers and ignoring the owner
+    c.execute("INSERT INTO flashcards_fts (flashcards_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 0.0)')")
+
+def _migrate_reviews(c):
+    # Spaced-repetition state of every flashcard; due_at is a Unix timestamp. A new card is
+    # due as soon as it is saved.
+    c.execute('''CREATE TABLE IF NOT EXISTS reviews
+                 (card_id INTEGER PRIMARY KEY,
+                  username TEXT,
+                  deck_id INTEGER,
+                  due_at REAL,
+                  interval_days REAL DEFAULT 0,
+                  ease REAL DEFAULT 2.5,
+                  repetitions INTEGER DEFAULT 0,
+                  lapses INTEGER DEFAULT 0,
+                  last_grade INTEGER,
+                  reviewed_at REAL,
+                  FOREIGN KEY (card_id) REFERENCES flashcards(id) ON DELETE CASCADE)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reviews_username_due ON reviews(username, due_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reviews_deck_due ON reviews(deck_id, due_at)")
+    c.execute('''CREATE TRIGGER IF NOT EXISTS reviews_insert AFTER INSERT ON flashcards BEGIN
+                     INSERT INTO reviews (card_id, username, deck_id, due_at)
+                     SELECT new.id, username, new.deck_id, (julianday('now') - 2440587.5) * 86400.0
+                     FROM decks WHERE id = new.deck_id;
+                 END''')
+    c.execute('''INSERT OR IGNORE INTO reviews (card_id, username, deck_id, due_at)
+                 SELECT f.id, d.username, f.deck_id, (julianday('now') - 2440587.5) * 86400.0
+                 FROM flashcards f JOIN decks d ON d.id = f.deck_id''')
+
+MIGRATIONS = [
+    _migrate_cascade_and_indexes,
+    _migrate_ingest_status,
+    _migrate_jobs,
+    _migrate_metrics,
+    _migrate_llama_profiles,
+    _migrate_flashcards_fts,
+    _migrate_reviews,
+]
+
+# Initialize database for storing flashcard decks
+def init_db():
+    conn = _connect(settings.DB_PATH)
+    c = conn.cursor()
+
+    # Create tables if they don't exist (without dropping existing ones)
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (username TEXT PRIMARY KEY, password TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS decks
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  username TEXT,
+                  deck_name TEXT,
+                  created_date TEXT,
+                  FOREIGN KEY (username) REFERENCES users(username))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS flashcards
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  deck_id INTEGER,
+                  question TEXT,
+                  answer TEXT,
+                  FOREIGN KEY (deck_id) REFERENCES decks(id) ON DELETE CASCADE)''')
+
+    # Caches of generated flashcards, extracted PDF pages and OCR results
+    c.execute('''CREATE TABLE IF NOT EXISTS generation_cache
+                 (cache_key TEXT PRIMARY KEY,
+                  cards TEXT,
+                  size INTEGER,
+                  last_used REAL)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_generation_cache_last_used
+                 ON generation_cache(last_used)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS page_cache
+                 (doc_hash TEXT,
+                  page_number INTEGER,
+                  text TEXT,
+                  last_used REAL,
+                  PRIMARY KEY (doc_hash, page_number))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS ocr_cache
+                 (image_hash TEXT PRIMARY KEY,
+                  text TEXT,
+                  last_used REAL)''')
+    conn.commit()
+
+    # Bring databases created by older versions up to date. Foreign keys are
+    # switched off while tables are rebuilt so existing rows are copied as they are.
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    if version < len(MIGRATIONS):
+        c.execute("PRAGMA foreign_keys=OFF")
+        c.execute("BEGIN")
+        with conn:
+            for migration in MIGRATIONS[version:]:
+                migration(c)
+            c.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        c.execute("PRAGMA foreign_keys=ON")
+
+    conn.close()
+
+# Current time in the format used by the date columns
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# Function to insert (deck_id, question, answer) rows into flashcards with the given cursor.
+# Each batch is one multi-row INSERT rather than an executemany of single-row statements:
+# FTS5 writes its pending index data at the end of every statement that fires the
+# indexing trigger, so one statement per row costs several times more.
+def insert_flashcards(c, rows):
+    for start in range(0, len(rows), settings.BULK_BATCH_SIZE):
+        c.execute('''INSERT INTO flashcards (deck_id, question, answer)
+                     SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+                     FROM json_each(?)''', (json.dumps(rows[start:start + settings.BULK_BATCH_SIZE]),))
+
+# Insert a deck and all its flashcards with the given cursor and return the deck id
+def _insert_deck(c, username, deck_name, flashcards):
+    c.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+    c.execute("INSERT INTO decks (username, deck_name, created_date) VALUES (?, ?, ?)",
+              (username, deck_name, _now()))
+    deck_id = c.lastrowid
+
+    insert_flashcards(c, [(deck_id, card["question"], card["answer"]) for card in flashcards])
+    return deck_id
+
+# Function to save a deck of flashcards to the database
+def save_deck(username, deck_name, flashcards):
+    with metrics.timer("db.save_deck", f"{len(flashcards)} cards"), connection() as conn:
+        deck_id = _insert_deck(conn.cursor(), username, deck_name, flashcards)
+    invalidate_deck_list(username)
+    return deck_id
+
+# Function to get the recorded ingestion status of every file as {path: (content_hash, status)}
+def get_ingest_statuses():
+    with connection() as conn:
+        rows = conn.execute("SELECT path, content_hash, status FROM ingest_status").fetchall()
+    return {path: (content_hash, status) for path, content_hash, status in rows}
+
+# Function to save the results of a batch of ingested files in one transaction.
+# Each result is a dict with path, content_hash, deck_name, flashcards and error;
+# files with flashcards become decks, and every file's status is recorded.
+def save_ingest_batch(username, results):
+    statuses = []
+    with metrics.timer("db.save_ingest_batch", f"{len(results)} files"), connection() as conn:
+        c = conn.cursor()
+        for result in results:
+            deck_id = None
+            if result["flashcards"]:
+                deck_id = _insert_deck(c, username, result["deck_name"], result["flashcards"])
+            status = "failed" if result["error"] else "done"
+            statuses.append((result["path"], result["content_hash"], status, deck_id,
+                             len(result["flashcards"]), result["error"], _now()))
+        c.executemany('''INSERT OR REPLACE INTO ingest_status
+                         (path, content_hash, status, deck_id, card_count, error, updated_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''', statuses)
+    invalidate_deck_list(username)
+
+# Function to add flashcards to an existing deck
+def add_cards_to_deck(deck_id, flashcards):
+    with metrics.timer("db.add_cards_to_deck", f"{len(flashcards)} cards"), connection() as conn:
+        insert_flashcards(conn.cursor(), [(deck_id, card["question"], card["answer"]) for card in flashcards])
+        row = conn.execute("SELECT username FROM decks WHERE id = ?", (deck_id,)).fetchone()
+    if row:
+        invalidate_deck_list(row[0])
+
+# Function to forget the cached deck list of a user
+def invalidate_deck_list(username):
+    with _deck_lists_lock:
+        _deck_lists.pop(username, None)
+
+# Function to get a user's decks as (id, deck_name, created_date, card_count), newest first.
+# The list is cached per user, so reruns don't query the card counts again. A cached list
+# is only served while the user's deck count and newest deck id are unchanged, so decks
+# added or deleted by other processes (batch ingestion, imports) show up too.
+def list_user_decks(username):
+    with connection() as conn:
+        version = conn.execute("SELECT COUNT(*), MAX(id) FROM decks WHERE username = ?",
+                               (username,)).fetchone()
+        with _deck_lists_lock:
+            cached = _deck_lists.get(username)
+            if cached is not None and cached[0] == version:
+                _deck_lists.move_to_end(username)
+                return cached[1]
+
+        with metrics.timer("db.list_user_decks"):
+            decks = conn.execute('''SELECT d.id, d.deck_name, d.created_date,
+                                           (SELECT COUNT(*) FROM flashcards f WHERE f.deck_id = d.id)
+                                    FROM decks d
+                                    WHERE d.username = ? ORDER BY d.created_date DESC, d.id DESC''',
+                                 (username,)).fetchall()
+
+    with _deck_lists_lock:
+        _deck_lists[username] = (version, decks)
+        while len(_deck_lists) > settings.DECK_LIST_CACHE_USERS:
+            _deck_lists.popitem(last=False)
+    return decks
+
+# Function to get one page of a user's decks, optionally filtered by name.
+# Returns the decks on the page and the number of matching decks.
+def get_user_deck_page(username, page, page_size, search=""):
+    decks = list_user_decks(username)
+    if search:
+        search = search.lower()
+        decks = [deck for deck in decks if search in deck[1].lower()]
+    return decks[page * page_size:(page + 1) * page_size], len(decks)
+
+# Function to get all flashcards in a deck
+def get_deck_flashcards(deck_id):
+    with metrics.timer("db.get_deck_flashcards") as sample, connection() as conn:
+        cards = conn.execute("SELECT question, answer FROM flashcards WHERE deck_id = ? ORDER BY id",
+                             (deck_id,)).fetchall()
+        sample["label"] = f"{len(cards)} cards"
+
+    # Convert to the format expected by the app
+    return [{"question": question, "answer": answer} for question, answer in cards]
+
+# Turn what the user typed into an FTS5 query in which every word must occur; quoting
+# each word keeps FTS5 operators and punctuation in the input from being interpreted
+def _fts_query(text):
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
+
+# Function to search all of a user's flashcards. Returns one page of matches, best first,
+# as (card_id, deck_id, deck_name, position in the deck, question snippet, answer snippet)
+# with the matched words in bold, and the number of matches.
+def search_flashcards(username, text, page=0, page_size=10):
+    query = _fts_query(text)
+    if query is None:
+        return [], 0
+    owner = "u" + username.encode("utf-8").hex().upper()
+    match = f"owner : {owner} AND {{question answer}} : ({query})"
+    with metrics.timer("db.search_flashcards") as sample, connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM flashcards_fts WHERE flashcards_fts MATCH ?",
+                             (match,)).fetchone()[0]
+        # FTS5 returns the matches in rank order, so only the cards on the page are
+        # snippeted and looked up
+        rows = conn.execute('''SELECT s.rowid, s.deck_id, d.deck_name,
+                                      (SELECT COUNT(*) FROM flashcards f
+                                       WHERE f.deck_id = s.deck_id AND f.id < s.rowid),
+                                      s.question, s.answer
+                               FROM (SELECT rowid, deck_id, rank,
+                                            snippet(flashcards_fts, 0, '**', '**', '...', 16) AS question,
+                                            snippet(flashcards_fts, 1, '**', '**', '...', 16) AS answer
+                                     FROM flashcards_fts WHERE flashcards_fts MATCH ?
+                                     ORDER BY rank LIMIT ? OFFSET ?) s
+                               JOIN decks d ON d.id = s.deck_id
+                               ORDER BY s.rank''',
+                            (match, page_size, page * page_size)).fetchall()
+        sample["label"] = f"{count} matches"
+    return rows, count
+
+# Function to delete a deck; its flashcards are removed by ON DELETE CASCADE
+def delete_deck(deck_id):
+    with metrics.timer("db.delete_deck"), connection() as conn:
+        row = conn.execute("SELECT username FROM decks WHERE id = ?", (deck_id,)).fetchone()
+        conn.execute("DELETE FROM decks WHERE id = ?", (deck_id,))
+    if row:
+        invalidate_deck_list(row[0])
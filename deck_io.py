@@ -0,0 +1,213 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import database
+import metrics
+import settings
+
+# Streaming export and import of decks as CSV, JSONL or Anki text files. Export reads the
+# cards through a cursor in batches and import inserts them in batches inside one
+# transaction, so memory stays constant however many cards a file holds.
+#
+#     python deck_io.py export --username alice --output decks.csv
+#     python deck_io.py import --username bob decks.csv
+#
+# CSV files have deck, question and answer columns, and JSONL files one object per line with
+# the same keys; the deck is optional on import. Anki files are the tab-separated text that
+# Anki's "Import File" reads (and its "Notes in Plain Text" export writes): front, back and
+# a deck column declared in the file header.
+
+FORMATS = ("csv", "jsonl", "anki")
+
+# Names Anki uses in the "#separator:" header
+ANKI_SEPARATORS = {"tab": "\t", "comma": ",", "semicolon": ";", "space": " ", "pipe": "|", "colon": ":"}
+
+# The format of a file from its extension
+def format_for_path(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension in (".txt", ".tsv"):
+        return "anki"
+    raise ValueError(f"Unknown deck file type '{extension}', expected one of .csv, .jsonl, .txt")
+
+# The (deck_name, question, answer) rows of a user's decks, or only the given decks, read
+# from the database a batch at a time
+def iter_cards(username, deck_ids=None):
+    query = '''SELECT d.deck_name, f.question, f.answer
+               FROM decks d JOIN flashcards f ON f.deck_id = d.id
+               WHERE d.username = ?'''
+    params = [username]
+    if deck_ids:
+        query += f" AND d.id IN ({', '.join('?' * len(deck_ids))})"
+        params += list(deck_ids)
+    with database.connection() as conn:
+        cursor = conn.execute(query + " ORDER BY d.id, f.id", params)
+        while True:
+            rows = cursor.fetchmany(settings.BULK_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+# Function to write a user's decks, or only the given decks, to a text file in one of
+# FORMATS. Returns the number of cards written.
+def export_cards(username, file, fmt, deck_ids=None):
+    count = 0
+    with metrics.timer("export", fmt) as sample:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(("deck", "question", "answer"))
+        elif fmt == "anki":
+            # Plain text, with the deck of every card in the third column
+            file.write("#separator:tab\n#html:false\n#columns:Front\tBack\tDeck\n#deck column:3\n")
+            writer = csv.writer(file, delimiter="\t", lineterminator="\n")
+
+        for deck_name, question, answer in iter_cards(username, deck_ids):
+            if fmt == "jsonl":
+                file.write(json.dumps({"deck": deck_name, "question": question, "answer": answer},
+                                      ensure_ascii=False) + "\n")
+            elif fmt == "anki":
+                writer.writerow((question, answer, deck_name))
+            else:
+                writer.writerow((deck_name, question, answer))
+            count += 1
+        sample["label"] = f"{fmt}, {count} cards"
+    return count
+
+# A (deck_name, question, answer) row, checked: question and answer must be non-empty
+# text, and the deck text or missing
+def _card(deck_name, question, answer, line_number):
+    for name, value in (("question", question), ("answer", answer)):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"Line {line_number} is not a flashcard: missing {name}")
+    if deck_name is not None and not isinstance(deck_name, str):
+        raise ValueError(f"Line {line_number} is not a flashcard: the deck must be text")
+    return deck_name, question, answer
+
+# The (deck_name, question, answer) rows of a CSV file; deck_name is None without a deck column
+def _read_csv(file):
+    reader = csv.DictReader(file)
+    if not {"question", "answer"} <= set(reader.fieldnames or ()):
+        raise ValueError("CSV files need a header row with question and answer columns")
+    for row in reader:
+        yield _card(row.get("deck"), row["question"], row["answer"], reader.line_num)
+
+def _read_jsonl(file):
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            card = json.loads(line)
+            deck_name, question, answer = card.get("deck"), card["question"], card["answer"]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Line {line_number} is not a flashcard: {e}") from e
+        yield _card(deck_name, question, answer, line_number)
+
+# Anki text files start with "#key:value" header lines. The deck, tags, GUID and note type
+# columns they declare are set apart, and the first two remaining columns are front and back.
+def _read_anki(file):
+    lines = iter(file)
+    header = {}
+    first_line = None
+    for line in lines:
+        if not line.startswith("#"):
+            first_line = line
+            break
+        key, _, value = line[1:].rstrip("\r\n").partition(":")
+        header[key.strip().lower()] = value.strip()
+    if first_line is None:
+        return
+
+    separator = header.get("separator", "tab")
+    separator = ANKI_SEPARATORS.get(separator.lower(), separator)
+    columns = {name: int(header[f"{name} column"]) - 1 for name in ("deck", "tags", "guid", "notetype")
+               if header.get(f"{name} column", "").isdigit()}
+    deck_column = columns.get("deck")
+    reader = csv.reader(itertools.chain([first_line], lines), delimiter=separator)
+    for row in reader:
+        if not any(field.strip() for field in row):
+            continue
+        fields = [field for index, field in enumerate(row) if index not in columns.values()]
+        fields += [None] * (2 - len(fields))
+        deck_name = row[deck_column] if deck_column is not None and deck_column < len(row) else None
+        # Line numbers count the header lines too
+        yield _card(deck_name, fields[0], fields[1], reader.line_num + len(header))
+
+def _read(file, fmt):
+    readers = {"csv": _read_csv, "jsonl": _read_jsonl, "anki": _read_anki}
+    try:
+        yield from readers[fmt](file)
+    except csv.Error as e:
+        raise ValueError(f"Malformed {fmt} file: {e}") from e
+
+# Function to import the cards of a text file in one of FORMATS for a user. Every deck
+# named in the file becomes a new deck, and cards without a deck go into default_deck_name.
+# All cards are inserted in one transaction, a batch per statement. Returns {deck_name: card count}.
+def import_cards(username, file, fmt, default_deck_name):
+    deck_ids = {}
+    counts = {}
+    batch = []
+    with metrics.timer("import", fmt) as sample, database.connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+        created_date = time.strftime("%Y-%m-%d %H:%M:%S")
+        for deck_name, question, answer in _read(file, fmt):
+            deck_name = deck_name or default_deck_name
+            if deck_name not in deck_ids:
+                c.execute("INSERT INTO decks (username, deck_name, created_date) VALUES (?, ?, ?)",
+                          (username, deck_name, created_date))
+                deck_ids[deck_name] = c.lastrowid
+                counts[deck_name] = 0
+            batch.append((deck_ids[deck_name], question, answer))
+            counts[deck_name] += 1
+            if len(batch) >= settings.BULK_BATCH_SIZE:
+                database.insert_flashcards(c, batch)
+                batch.clear()
+        database.insert_flashcards(c, batch)
+        sample["label"] = f"{fmt}, {sum(counts.values())} cards"
+    database.invalidate_deck_list(username)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import flashcard decks as CSV, JSONL or Anki text")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write a user's decks to a file")
+    export_parser.add_argument("--username", required=True)
+    export_parser.add_argument("--output", required=True, help="File to write, or - for standard output")
+    export_parser.add_argument("--format", choices=FORMATS, help="Default: from the file extension")
+    export_parser.add_argument("--deck-id", type=int, action="append", help="Only this deck (repeatable)")
+    import_parser = subparsers.add_parser("import", help="Add the decks in a file to a user's decks")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--username", required=True)
+    import_parser.add_argument("--format", choices=FORMATS, help="Default: from the file extension")
+    import_parser.add_argument("--deck-name", help="Deck for cards without one (default: the file name)")
+    args = parser.parse_args()
+
+    database.init_db()
+    start = time.perf_counter()
+    if args.command == "export":
+        fmt = args.format or ("csv" if args.output == "-" else format_for_path(args.output))
+        if args.output == "-":
+            count = export_cards(args.username, sys.stdout, fmt, args.deck_id)
+        else:
+            with open(args.output, "w", encoding="utf-8", newline="") as f:
+                count = export_cards(args.username, f, fmt, args.deck_id)
+        print(f"Exported {count} cards in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    else:
+        fmt = args.format or format_for_path(args.file)
+        deck_name = args.deck_name or os.path.splitext(os.path.basename(args.file))[0]
+        with open(args.file, encoding="utf-8-sig", newline="") as f:
+            counts = import_cards(args.username, f, fmt, deck_name)
+        for name, count in counts.items():
+            print(f"{name}: {count} cards")
+        print(f"Imported {sum(counts.values())} cards into {len(counts)} decks in "
+              f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import collections
+import itertools
+import re
+import numpy as np
+import metrics
+import settings
+
+# Near-duplicate flashcard detection with MinHash and locality-sensitive hashing.
+# Every card is reduced to its set of words and word pairs, MinHash signatures are computed
+# for all cards at once in NumPy, and only cards that share a signature band are compared
+# exactly, so large decks are deduplicated without comparing every pair of cards.
+
+WORD = re.compile(r"\w+")
+
+# str.translate table that keeps the characters WORD matches and turns every other one
+# into a space, filled in as characters are first seen; translating and splitting gives
+# the same words as WORD.findall in about half the time
+class _WordCharacters(dict):
+    def __missing__(self, code):
+        self[code] = value = code if WORD.match(chr(code)) else 32
+        return value
+
+_WORD_CHARACTERS = _WordCharacters()
+
+# 36 hash functions in 12 bands of 3: pairs with a Jaccard similarity of 0.7 share a band
+# with probability above 99%, while unrelated cards rarely become candidates
+NUM_HASHES = 36
+BAND_ROWS = 3
+
+_rng = np.random.default_rng(20240501)
+# Features are folded to 32 bits with one multiply-shift hash, and every MinHash function
+# is an odd multiplier and an offset modulo 2**32, a bijection of the 32-bit values
+_FOLD = np.uint64(_rng.integers(1, 2**63, dtype=np.uint64) | np.uint64(1))
+_HASH_A = _rng.integers(1, 2**32, size=NUM_HASHES, dtype=np.uint32) | np.uint32(1)
+_HASH_B = _rng.integers(0, 2**32, size=NUM_HASHES, dtype=np.uint32)
+_BAND_MIX = _rng.integers(1, 2**63, size=BAND_ROWS, dtype=np.uint64) | np.uint64(1)
+
+# The lowercase words of a card's question and answer
+def _words(card):
+    return tuple(f"{card['question']} {card['answer']}".lower().translate(_WORD_CHARACTERS).split())
+
+# Words and adjacent word pairs of each card as integers, grouped by card: returns the
+# features and the number of features of every card
+def _features(card_words):
+    vocabulary = collections.defaultdict(itertools.count().__next__)
+    ids = []
+    lengths = []
+    for words in card_words:
+        ids.extend(map(vocabulary.__getitem__, words))
+        lengths.append(len(words))
+
+    ids = np.array(ids, dtype=np.uint64)
+    owners = np.repeat(np.arange(len(card_words)), lengths)
+    same_card = owners[1:] == owners[:-1]
+    word_pairs = (((ids[:-1] + np.uint64(1)) << np.uint64(32)) | ids[1:])[same_card]
+    features = np.concatenate((ids, word_pairs))
+    owners = np.concatenate((owners, owners[1:][same_card]))
+    order = np.argsort(owners, kind="stable")
+    return features[order], np.bincount(owners, minlength=len(card_words))
+
+# MinHash signatures of cards with at least one feature, as an array of shape (cards, NUM_HASHES)
+def _signatures(features, counts):
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[counts > 0]
+    folded = ((features * _FOLD) >> np.uint64(32)).astype(np.uint32)
+    signatures = np.empty((NUM_HASHES, len(starts)), dtype=np.uint32)
+    # A few hash functions at a time keeps the intermediate array small, and one row per
+    # hash function keeps every card's features contiguous for reduceat
+    hashed = np.empty((6, len(folded)), dtype=np.uint32)
+    for block in range(0, NUM_HASHES, 6):
+        np.multiply(_HASH_A[block:block + 6, None], folded, out=hashed)
+        hashed += _HASH_B[block:block + 6, None]
+        signatures[block:block + 6] = np.minimum.reduceat(hashed, starts, axis=1)
+    return signatures.T
+
+# Pairs (i, j) with i < j of rows that share a band of their signatures. Within a bucket of
+# rows with the same band, every row is paired with the first and with the one before it.
+def _candidate_pairs(signatures):
+    firsts = []
+    seconds = []
+    for band in range(0, NUM_HASHES, BAND_ROWS):
+        keys = signatures[:, band:band + BAND_ROWS].astype(np.uint64) @ _BAND_MIX
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        repeated = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1]) + 1
+        if not len(repeated):
+            continue
+        # Position of the first row of each row's bucket
+        bucket_starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        bucket_first = bucket_starts[np.searchsorted(bucket_starts, repeated, side="right") - 1]
+        firsts.extend((order[bucket_first], order[repeated - 1]))
+        seconds.extend((order[repeated], order[repeated]))
+    if not firsts:
+        return np.empty((0, 2), dtype=np.int64)
+    # Deduplicate the pairs as single integers, which is much faster than rows
+    rows = len(signatures)
+    pairs = np.unique(np.concatenate(firsts) * rows + np.concatenate(seconds))
+    return np.stack((pairs // rows, pairs % rows), axis=1)
+
+def _jaccard(a, b):
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+# Function to drop near-duplicate flashcards, keeping the first card of every group of
+# near-duplicates. A card is also dropped when it nearly duplicates one of existing_cards,
+# e.g. the cards already in the deck it is added to. Returns the cards that are kept.
+def dedupe_cards(cards, existing_cards=(), threshold=None):
+    if threshold is None:
+        threshold = settings.DEDUPE_THRESHOLD
+    cards = list(cards)
+    existing_cards = list(existing_cards)
+    with metrics.timer("dedupe", f"{len(cards)} cards") as sample:
+        kept = _dedupe(cards, existing_cards, threshold)
+        sample["label"] = f"{len(cards)} cards, {len(cards) - len(kept)} removed"
+    return kept
+
+def _dedupe(cards, existing_cards, threshold):
+    all_cards = existing_cards + cards
+    if not cards:
+        return cards
+
+    # Cards with exactly the same words are duplicates without any hashing; only the first
+    # card of each group takes part in the similarity search. Cards without any words
+    # (only punctuation or symbols) can't be compared and are never duplicates.
+    card_words = [_words(card) for card in all_cards]
+    first_seen = {}
+    same_as = [first_seen.setdefault(words, index) if words else index
+               for index, words in enumerate(card_words)]
+    distinct = np.flatnonzero(np.array(same_as) == np.arange(len(all_cards)))
+
+    similar = {}
+    features, counts = _features([card_words[i] for i in distinct])
+    # Cards without any words can't be compared
+    indexed = np.flatnonzero(counts > 0)
+    pairs = _candidate_pairs(_signatures(features, counts)) if len(indexed) >= 2 else []
+    if len(pairs):
+        # Compare the candidates exactly on their sets of features
+        starts = np.concatenate(([0], np.cumsum(counts))).tolist()
+        feature_list = features.tolist()
+        feature_sets = {}
+        for row in np.unique(indexed[pairs]).tolist():
+            feature_sets[row] = set(feature_list[starts[row]:starts[row + 1]])
+        card_index = distinct.tolist()
+        for i, j in indexed[pairs].tolist():
+            if _jaccard(feature_sets[i], feature_sets[j]) >= threshold:
+                similar.setdefault(card_index[j], []).append(card_index[i])
+
+    # Walk the cards in order: existing cards are always kept, and a new card is dropped when
+    # it repeats an earlier card exactly or is similar to an earlier card that was kept
+    kept = [True] * len(all_cards)
+    for j in range(len(existing_cards), len(all_cards)):
+        if same_as[j] != j or any(kept[i] for i in similar.get(j, ())):
+            kept[j] = False
+    return [card for card, keep in zip(cards, kept[len(existing_cards):]) if keep]
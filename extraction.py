@@ -0,0 +1,296 @@
+import atexit
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2 as pdfread
+import pytesseract
+from PIL import Image
+import database
+import metrics
+import settings
+
+# Set up Tesseract OCR
+pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_PATH
+
+# Text extraction from uploaded documents, kept free of Streamlit so worker
+# processes and command-line tools can import it
+
+_extraction_pool = None
+_extraction_pool_size = 0
+_extraction_pool_lock = threading.Lock()
+
+# Function to hash a document's bytes for cache keys
+def document_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+# Function to get the cached text of a document's pages as {page_number: text}
+def get_cached_pages(doc_hash):
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT page_number, text FROM page_cache WHERE doc_hash = ?", (doc_hash,))
+        pages = dict(c.fetchall())
+        if pages:
+            c.execute("UPDATE page_cache SET last_used = ? WHERE doc_hash = ?", (time.time(), doc_hash))
+    return pages
+
+# Function to store the text of some of a document's pages
+def put_cached_pages(doc_hash, pages):
+    now = time.time()
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.executemany("INSERT OR REPLACE INTO page_cache (doc_hash, page_number, text, last_used) VALUES (?, ?, ?, ?)",
+                      [(doc_hash, page_number, text, now) for page_number, text in pages.items()])
+        _evict(c, "page_cache", "doc_hash", settings.PAGE_CACHE_MAX_BYTES)
+
+# Function to get the cached OCR text of images as {image_hash: text}
+def get_cached_ocr(image_hashes):
+    results = {}
+    with database.connection() as conn:
+        c = conn.cursor()
+        for image_hash in set(image_hashes):
+            c.execute("SELECT text FROM ocr_cache WHERE image_hash = ?", (image_hash,))
+            row = c.fetchone()
+            if row is not None:
+                results[image_hash] = row[0]
+        if results:
+            c.executemany("UPDATE ocr_cache SET last_used = ? WHERE image_hash = ?",
+                          [(time.time(), image_hash) for image_hash in results])
+    return results
+
+# Function to store OCR text by image hash
+def put_cached_ocr(results):
+    now = time.time()
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.executemany("INSERT OR REPLACE INTO ocr_cache (image_hash, text, last_used) VALUES (?, ?, ?)",
+                      [(image_hash, text, now) for image_hash, text in results.items()])
+        _evict(c, "ocr_cache", "image_hash", settings.OCR_CACHE_MAX_BYTES)
+
+# Drop the least recently used entries of a cache table until it fits in max_bytes.
+# Rows sharing a group_column value (e.g. all pages of a document) are dropped together.
+def _evict(c, table, group_column, max_bytes):
+    c.execute(f"SELECT COALESCE(SUM(LENGTH(text)), 0) FROM {table}")
+    excess = c.fetchone()[0] - max_bytes
+    if excess <= 0:
+        return
+
+    c.execute(f'''SELECT {group_column}, SUM(LENGTH(text)) FROM {table}
+                  GROUP BY {group_column} ORDER BY MAX(last_used)''')
+    stale_groups = []
+    for group, size in c.fetchall():
+        if excess <= 0:
+            break
+        stale_groups.append((group,))
+        excess -= size
+    c.executemany(f"DELETE FROM {table} WHERE {group_column} = ?", stale_groups)
+
+# Otsu's method: the grey level that best separates dark text from a light background
+def _otsu_threshold(histogram):
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background_count = 0
+    background_sum = 0
+    best_threshold = 128
+    best_variance = 0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        background_mean = background_sum / background_count
+        foreground_mean = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = level
+    return best_threshold
+
+# Function to prepare an image for OCR: grayscale, scaled down to the target DPI, and binarized
+def preprocess_image(img):
+    img = img.convert("L")
+
+    dpi = img.info.get("dpi")
+    if dpi and dpi[0] > settings.OCR_TARGET_DPI:
+        scale = settings.OCR_TARGET_DPI / float(dpi[0])
+    else:
+        scale = min(1.0, settings.OCR_MAX_SIDE / float(max(img.size)))
+    if scale < 1.0:
+        new_size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        img = img.resize(new_size, Image.LANCZOS)
+
+    threshold = _otsu_threshold(img.histogram())
+    return img.point(lambda level: 255 if level > threshold else 0, mode="1")
+
+# Run tesseract on one image's bytes
+def _ocr_image(image_bytes):
+    img = Image.open(io.BytesIO(image_bytes))
+    return pytesseract.image_to_string(preprocess_image(img))
+
+# Runs once in every extraction worker: one tesseract thread per process,
+# since the pool already keeps every core busy
+def _init_extraction_worker():
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+# Function to OCR a batch of images (as bytes), returning their text in the same order.
+# Results are cached by image content hash, and uncached images are OCR'd in parallel.
+def ocr_images(images, workers=None):
+    if workers is None:
+        workers = settings.EXTRACTION_WORKERS or os.cpu_count() or 1
+    image_hashes = [document_hash(image_bytes) for image_bytes in images]
+    results = get_cached_ocr(image_hashes)
+
+    missing = {}
+    for image_hash, image_bytes in zip(image_hashes, images):
+        if image_hash not in results:
+            missing[image_hash] = image_bytes
+
+    if missing:
+        with metrics.timer("ocr", f"{len(missing)} images"):
+            if workers <= 1 or len(missing) == 1:
+                new_results = {image_hash: _ocr_image(image_bytes) for image_hash, image_bytes in missing.items()}
+            else:
+                pool = get_extraction_pool(workers)
+                new_results = dict(zip(missing, pool.map(_ocr_image, missing.values())))
+        put_cached_ocr(new_results)
+        results.update(new_results)
+
+    return [results[image_hash] for image_hash in image_hashes]
+
+# Runs in a worker process: extract the text of pages [start, end) of a PDF file.
+# Worker processes don't run atexit handlers, so the OCR timings of scanned pages are
+# written before the range is returned.
+def _extract_page_range(pdf_path, start, end):
+    try:
+        pdf_reader = pdfread.PdfReader(pdf_path)
+        return [_extract_page(pdf_reader, page_num) for page_num in range(start, end)]
+    finally:
+        metrics.flush()
+
+# Function to get the extraction pool, starting it (or resizing it) on first use
+def get_extraction_pool(workers):
+    global _extraction_pool, _extraction_pool_size
+    with _extraction_pool_lock:
+        if _extraction_pool is not None and _extraction_pool_size != workers:
+            _extraction_pool.shutdown()
+            _extraction_pool = None
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(max_workers=workers,
+                                                   mp_context=multiprocessing.get_context("spawn"),
+                                                   initializer=_init_extraction_worker)
+            _extraction_pool_size = workers
+        return _extraction_pool
+
+# Function to stop the extraction pool
+def shutdown_extraction_pool():
+    global _extraction_pool, _extraction_pool_size
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown()
+        _extraction_pool = None
+        _extraction_pool_size = 0
+
+atexit.register(shutdown_extraction_pool)
+
+# Group page numbers into contiguous (start, end) ranges of at most range_size pages
+def _page_ranges(page_numbers, range_size):
+    ranges = []
+    for page_num in page_numbers:
+        if ranges and ranges[-1][1] == page_num and ranges[-1][1] - ranges[-1][0] < range_size:
+            ranges[-1][1] = page_num + 1
+        else:
+            ranges.append([page_num, page_num + 1])
+    return [tuple(page_range) for page_range in ranges]
+
+# Extract the text of one page of an open PDF, treating unreadable pages as empty.
+# Pages with (almost) no text layer are scanned pages: their embedded images are OCR'd instead.
+def _extract_page(pdf_reader, page_num):
+    try:
+        page = pdf_reader.pages[page_num]
+        text = page.extract_text() or ""
+    except Exception:
+        return ""
+
+    if len(text.strip()) < settings.OCR_MIN_PAGE_CHARS:
+        try:
+            # Already inside a worker (or a small document), so OCR the page's images serially
+            image_texts = ocr_images([image.data for image in page.images], workers=1)
+            text = "\n".join([text] + image_texts).strip()
+        except Exception:
+            pass
+    return text
+
+# Function to extract the text of every page of a PDF, yielding pages in order as soon
+# as they are available. Pages already seen are served from the page cache, and large
+# documents are split into page ranges that are extracted in parallel.
+def iter_pdf_pages(pdf_bytes, workers=None):
+    if workers is None:
+        workers = settings.EXTRACTION_WORKERS or os.cpu_count() or 1
+    doc_hash = document_hash(pdf_bytes)
+    cached_pages = get_cached_pages(doc_hash)
+
+    pdf_reader = pdfread.PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(pdf_reader.pages)
+    missing_pages = [page_num for page_num in range(page_count) if page_num not in cached_pages]
+
+    # Small documents aren't worth the round trip to the pool
+    if workers <= 1 or len(missing_pages) < settings.PARALLEL_PDF_MIN_PAGES:
+        new_pages = {}
+        for page_num in range(page_count):
+            if page_num not in cached_pages:
+                cached_pages[page_num] = new_pages[page_num] = _extract_page(pdf_reader, page_num)
+            yield cached_pages[page_num]
+        if new_pages:
+            put_cached_pages(doc_hash, new_pages)
+        return
+
+    # Workers read the PDF from a temporary file instead of receiving a copy of it with every range
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+
+        # A few ranges per worker so the pool stays busy when some pages are slower than others
+        range_size = max(1, -(-len(missing_pages) // (workers * 4)))
+        pool = get_extraction_pool(workers)
+        pending = {}
+        for start, end in _page_ranges(missing_pages, range_size):
+            future = pool.submit(_extract_page_range, pdf_path, start, end)
+            for page_num in range(start, end):
+                pending[page_num] = (future, start, end)
+
+        for page_num in range(page_count):
+            if page_num not in cached_pages:
+                future, start, end = pending[page_num]
+                range_pages = dict(zip(range(start, end), future.result()))
+                put_cached_pages(doc_hash, range_pages)
+                cached_pages.update(range_pages)
+            yield cached_pages[page_num]
+    finally:
+        os.remove(pdf_path)
+
+# Function to extract the whole text of a PDF. Chunking needs the whole document (repeated
+# headers and footers are found across all pages), so pages are joined before chunking.
+def extract_pdf_text(pdf_bytes):
+    return "\n".join(iter_pdf_pages(pdf_bytes))
+
+# File extensions that can be turned into text
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS + (".pdf", ".txt")
+
+# Function to extract the text of a document from its file name and contents
+def extract_document(filename, data):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return ocr_images([data])[0]
+    if extension == ".pdf":
+        return extract_pdf_text(data)
+    if extension == ".txt":
+        return data.decode("utf-8")
+    raise ValueError(f"Unsupported file type: {filename}")
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import time
+import database
+import settings
+
+# Persistent, content-addressed cache of parsed flashcards per chunk, stored in flashcards.db.
+# Entries are keyed on the chunk text, the model file, the prompt version and the sampling
+# parameters, and the least recently used entries are evicted once the cache grows too large.
+
+_cache_stats = {"hits": 0, "misses": 0}
+
+# Identify a model file without hashing gigabytes of weights
+def model_fingerprint(model_path):
+    try:
+        stat = os.stat(model_path)
+        return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        return os.path.basename(model_path)
+
+# Function to build the cache key for one chunk
+def cache_key(chunk, model_id, prompt_version, sampling_params):
+    key_source = json.dumps([chunk, model_id, prompt_version, sampling_params], sort_keys=True)
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+# Function to look up the cached flashcards for a key, or None on a miss
+def get_cached_cards(key):
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT cards FROM generation_cache WHERE cache_key = ?", (key,))
+        row = c.fetchone()
+        if row is None:
+            _cache_stats["misses"] += 1
+            return None
+        c.execute("UPDATE generation_cache SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+
+    _cache_stats["hits"] += 1
+    return json.loads(row[0])
+
+# Function to store the flashcards generated for a key
+def put_cached_cards(key, cards):
+    cards_json = json.dumps(cards)
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR REPLACE INTO generation_cache (cache_key, cards, size, last_used) VALUES (?, ?, ?, ?)",
+                  (key, cards_json, len(cards_json), time.time()))
+        _evict(c, settings.GENERATION_CACHE_MAX_BYTES)
+
+# Delete least recently used entries until the cache fits in max_bytes
+def _evict(c, max_bytes):
+    c.execute("SELECT COALESCE(SUM(size), 0) FROM generation_cache")
+    excess = c.fetchone()[0] - max_bytes
+    if excess <= 0:
+        return
+
+    c.execute("SELECT cache_key, size FROM generation_cache ORDER BY last_used")
+    stale_keys = []
+    for key, size in c.fetchall():
+        if excess <= 0:
+            break
+        stale_keys.append((key,))
+        excess -= size
+    c.executemany("DELETE FROM generation_cache WHERE cache_key = ?", stale_keys)
+
+# Function to get a copy of the cache hit and miss counters
+def cache_stats():
+    return dict(_cache_stats)
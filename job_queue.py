@@ -0,0 +1,156 @@
+import json
+import logging
+import threading
+import time
+import database
+import llm_engine
+import settings
+
+# Persistent queue of flashcard generation jobs, stored in the jobs table of flashcards.db
+# and worked through by a background thread that shares the app's loaded model.
+# Jobs run one at a time because there is one model; with LLM_WORKERS > 1 a job's chunks
+# are generated in parallel by the worker pool instead. Jobs survive browser disconnects, and a job that was running when the server stopped
+# is queued again when the worker starts.
+
+logger = logging.getLogger(__name__)
+
+_new_job = threading.Event()
+_worker = None
+
+# Function to add a generation job to the queue and return its id
+def submit_job(username, text):
+    with database.connection() as conn:
+        job_id = conn.execute('''INSERT INTO jobs (username, text, status, created_at)
+                                 VALUES (?, ?, 'queued', ?)''',
+                              (username, text, time.time())).lastrowid
+    _new_job.set()
+    return job_id
+
+# Function to get a job as a dict (without its input text), or None
+def get_job(job_id):
+    with database.connection() as conn:
+        row = conn.execute('''SELECT id, username, status, chunks_done, chunks_total, cards, error,
+                                     created_at, started_at, finished_at
+                              FROM jobs WHERE id = ?''', (job_id,)).fetchone()
+    if row is None:
+        return None
+    return _job_dict(row)
+
+# Function to get a user's most recent jobs, newest first
+def get_user_jobs(username, limit=5):
+    with database.connection() as conn:
+        rows = conn.execute('''SELECT id, username, status, chunks_done, chunks_total, cards, error,
+                                      created_at, started_at, finished_at
+                               FROM jobs WHERE username = ? ORDER BY id DESC LIMIT ?''',
+                            (username, limit)).fetchall()
+    return [_job_dict(row) for row in rows]
+
+def _job_dict(row):
+    keys = ("id", "username", "status", "chunks_done", "chunks_total", "cards", "error",
+            "created_at", "started_at", "finished_at")
+    job = dict(zip(keys, row))
+    job["cards"] = json.loads(job["cards"]) if job["cards"] else []
+    return job
+
+# Function to get the queue depth and wait times in seconds
+def queue_stats():
+    now = time.time()
+    with database.connection() as conn:
+        queued, oldest = conn.execute('''SELECT COUNT(*), MIN(created_at) FROM jobs
+                                         WHERE status = 'queued' ''').fetchone()
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+        # Average wait of the last 50 jobs that have started
+        average_wait = conn.execute('''SELECT AVG(started_at - created_at) FROM
+                                       (SELECT started_at, created_at FROM jobs
+                                        WHERE started_at IS NOT NULL ORDER BY id DESC LIMIT 50)''').fetchone()[0]
+    return {
+        "queued": queued,
+        "running": running,
+        "oldest_wait": now - oldest if oldest else 0.0,
+        "average_wait": average_wait or 0.0,
+    }
+
+# Take the oldest queued job and mark it running; returns (id, text) or None
+def _claim_next_job():
+    with database.connection() as conn:
+        # IMMEDIATE takes the write lock up front so two workers can't claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT id, text FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                         (time.time(), row[0]))
+    return row
+
+# Store the progress and the cards generated so far, so the app can show them early
+def _update_job(job_id, chunks_done, chunks_total, cards):
+    with database.connection() as conn:
+        conn.execute("UPDATE jobs SET chunks_done = ?, chunks_total = ?, cards = ? WHERE id = ?",
+                     (chunks_done, chunks_total, json.dumps(cards), job_id))
+
+def _finish_job(job_id, cards, error=None):
+    with database.connection() as conn:
+        conn.execute('''UPDATE jobs SET status = ?, cards = ?, error = ?, finished_at = ?,
+                                        text = NULL
+                        WHERE id = ?''',
+                     ("failed" if error else "done", json.dumps(cards), error, time.time(), job_id))
+
+# Generate the flashcards of one job
+def _run_job(llm, job_id, text):
+    cards = []
+    warnings = []
+
+    def on_progress(done, total):
+        _update_job(job_id, done, total, cards)
+
+    try:
+        if settings.LLM_WORKERS > 1:
+            # The worker pool generates chunks in parallel but returns them all at the end
+            cards = llm_engine.generate_flashcards(text, llm, progress_callback=on_progress,
+                                                   warning_callback=warnings.append)
+        else:
+            for card in llm_engine.stream_flashcards(text, llm, progress_callback=on_progress,
+                                                     warning_callback=warnings.append):
+                cards.append(card)
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        _finish_job(job_id, cards, f"Generation failed: {e}")
+        return
+    _finish_job(job_id, cards, None if cards else (warnings[0] if warnings else "No flashcards could be generated"))
+
+# Worker thread: run queued jobs until the process exits
+def _worker_loop(load_llm):
+    llm = None
+    while True:
+        job = None
+        try:
+            job = _claim_next_job()
+            if job is None:
+                _new_job.wait(timeout=5)
+                _new_job.clear()
+                continue
+            if llm is None:
+                llm = load_llm()
+            _run_job(llm, *job)
+        except Exception as e:
+            # Keep the worker alive, e.g. when the database is briefly locked or the model fails to load
+            logger.exception("Job worker error")
+            if job is not None:
+                try:
+                    _finish_job(job[0], [], f"Generation failed: {e}")
+                except Exception:
+                    logger.exception("Could not record the failure of job %s", job[0])
+            time.sleep(1)
+
+# Function to start the background worker. load_llm is called once a job arrives,
+# so the model is shared with the rest of the process instead of loaded again.
+def start_worker(load_llm):
+    global _worker
+    if _worker is not None:
+        return _worker
+    # Jobs left running by a previous server process will never finish; queue them again
+    with database.connection() as conn:
+        conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+
+    _worker = threading.Thread(target=_worker_loop, args=(load_llm,), daemon=True)
+    _worker.start()
+    return _worker
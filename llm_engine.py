@@ -0,0 +1,460 @@
+import atexit
+import json
+import multiprocessing
+import os
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from llama_cpp import Llama, LlamaGrammar
+from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+import settings
+import autotune
+import generation_cache
+import metrics
+from text_processing import (optimize_text, chunk_text, llm_token_counter, split_documents,
+                             strip_boilerplate, information_score, DOCUMENT_HEADER)
+
+# Streamlit-free flashcard generation logic shared by the app and other entry points
+
+PROMPT = """
+    Based on the following text, generate 5-10 flashcards based on the amount of content in JSON format.
+    Each flashcard should have a "question" and "answer" field.
+    The questions should test understanding of key concepts from the text.
+    Format the response as a valid JSON array of objects.
+    Be creative with the questions.
+
+    Example format:
+    [
+        {"question": "What is the main idea of the text?", "answer": "The main idea is..."},
+        {"question": "Define the term X", "answer": "X is defined as..."},
+        {"question": "What is true for X", "answer": "Y is true when X..."}
+    ]
+
+    Text to generate flashcards from:
+    """
+
+# Bump whenever PROMPT changes so cached generations from the old prompt are not reused
+PROMPT_VERSION = 2
+
+# Sampling parameters used for every chunk (llama-cpp-python's defaults, spelled out
+# so they are part of the generation cache key)
+SAMPLING_PARAMS = {
+    "max_tokens": settings.MAX_TOKENS,
+    "temperature": 0.8,
+    "top_p": 0.95,
+    "top_k": 40,
+    "repeat_penalty": 1.1,
+    "stop": ["<|end|>"]
+}
+
+# GBNF grammar for a JSON array of {"question": ..., "answer": ...} objects. With grammar
+# decoding every sampled token keeps the output valid, and generation ends as soon as
+# the array is closed instead of running on into prose.
+FLASHCARD_GRAMMAR = r'''
+root   ::= "[" ws card (ws "," ws card)* ws "]"
+card   ::= "{" ws "\"question\"" ws ":" ws string ws "," ws "\"answer\"" ws ":" ws string ws "}"
+string ::= "\"" char+ "\""
+char   ::= [^"\\\x00-\x1f] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F])
+ws     ::= [ \t\n]*
+'''
+
+# Everything before the chunk text is identical for every call
+PROMPT_PREFIX = f"<|user|>\n{PROMPT}\n"
+PROMPT_SUFFIX = "\n<|end|>\n<|assistant|>"
+
+# Tokens of PROMPT_PREFIX, one list per loaded model
+_prefix_tokens = weakref.WeakKeyDictionary()
+_prefix_cache_stats = {"hits": 0, "misses": 0}
+
+# Parsed FLASHCARD_GRAMMAR, built once per process
+_grammar = None
+
+# Tokens processed by the model since the process started
+_token_usage = {"prompt_tokens": 0, "completion_tokens": 0}
+
+# Worker pool state: the pool itself and, inside each worker process, its own model
+_worker_pool = None
+_worker_pool_size = 0
+_worker_llm = None
+
+# Function to load the Llama model with the tuned or configured runtime parameters.
+# The GGUF file is memory-mapped by default, so several processes loading the same file
+# share its pages instead of copying the weights. With speculative decoding, draft tokens
+# are looked up in the prompt: answers that copy phrases from the chunk are then verified
+# several tokens per model evaluation.
+def load_model(n_threads=None, speculative=None):
+    if speculative is None:
+        speculative = settings.SPECULATIVE_DECODING
+    options = autotune.runtime_params()
+    if n_threads:
+        # Worker processes get their share of the cores for both decoding and prompt evaluation
+        options["n_threads"] = options["n_threads_batch"] = n_threads
+    if speculative:
+        options["draft_model"] = LlamaPromptLookupDecoding(num_pred_tokens=settings.SPECULATIVE_DRAFT_TOKENS)
+    return Llama(
+        model_path=settings.MODEL_PATH,
+        n_ctx=settings.N_CTX,
+        n_gpu_layers=settings.N_GPU_LAYERS,
+        **options
+    )
+
+# Function to get the parsed flashcard grammar
+def flashcard_grammar():
+    global _grammar
+    if _grammar is None:
+        _grammar = LlamaGrammar.from_string(FLASHCARD_GRAMMAR, verbose=False)
+    return _grammar
+
+# Keyword arguments for every completion: the sampling parameters, plus the grammar
+# when grammar decoding is on
+def completion_params():
+    if settings.GRAMMAR_DECODING:
+        return dict(SAMPLING_PARAMS, grammar=flashcard_grammar())
+    return SAMPLING_PARAMS
+
+# Everything that affects the output besides the prompt and model, for generation cache keys
+def generation_params():
+    return dict(SAMPLING_PARAMS, grammar=FLASHCARD_GRAMMAR if settings.GRAMMAR_DECODING else None)
+
+# Function to build the full prompt for one chunk
+def build_prompt(chunk):
+    return f"{PROMPT_PREFIX}{chunk}{PROMPT_SUFFIX}"
+
+# Function to tokenize a prompt the way llama-cpp-python's completion tokenizes a text
+# prompt: with BOS, and with control tokens such as <|user|> read as single special tokens.
+# Completions are given these tokens, so the prefix check below sees what is evaluated.
+def tokenize_prompt(llm, prompt):
+    return llm.tokenize(prompt.encode("utf-8"), special=True)
+
+# Number of tokens available for chunk text once the prompt and answer are accounted for
+def chunk_token_budget(llm):
+    prompt_tokens = len(tokenize_prompt(llm, build_prompt("")))
+    return llm.n_ctx() - prompt_tokens - settings.MAX_TOKENS - settings.CHUNK_SAFETY_MARGIN
+
+# Function to clean text and split it into chunks that fill the context window.
+# Each document is chunked on its own so one changed file doesn't shift the others' chunks.
+# Chunks with too little content for flashcards are left out and reported through
+# warning_callback(message).
+def split_into_chunks(text, llm, warning_callback=None):
+    count_tokens = llm_token_counter(llm)
+    budget = chunk_token_budget(llm)
+    documents = []
+    with metrics.timer("chunking") as sample:
+        for document in split_documents(text):
+            header = DOCUMENT_HEADER.match(document)
+            name = header.group(1) if header else "the text"
+            cleaned = optimize_text(document)
+            if settings.CHUNK_FILTER:
+                cleaned = strip_boilerplate(cleaned)
+            documents.append((name, chunk_text(cleaned, count_tokens, budget,
+                                               settings.CHUNK_OVERLAP_TOKENS)))
+        sample["label"] = f"{sum(len(chunks) for _, chunks in documents)} chunks"
+
+    if not settings.CHUNK_FILTER:
+        return [chunk for _, chunks in documents for chunk in chunks]
+    text_chunks = []
+    skipped = []
+    with metrics.timer("filter") as sample:
+        for name, chunks in documents:
+            for part, chunk in enumerate(chunks, 1):
+                score, reason = information_score(chunk)
+                if score >= settings.CHUNK_MIN_INFORMATION:
+                    text_chunks.append(chunk)
+                else:
+                    skipped.append(f"{name} part {part} ({reason})")
+        sample["label"] = f"{len(skipped)} of {len(text_chunks) + len(skipped)} chunks skipped"
+    if skipped and warning_callback:
+        listed = "; ".join(skipped[:10]) + ("; ..." if len(skipped) > 10 else "")
+        warning_callback(f"Skipped {len(skipped)} chunks with little content: {listed}")
+    return text_chunks
+
+# Number of leading tokens two token lists have in common
+def _shared_length(a, b):
+    shared = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        shared += 1
+    return shared
+
+# Count whether a prompt's instruction prefix is already in the model's KV cache. Every
+# chunk's prompt starts with the same prefix, and llama-cpp-python only evaluates the
+# tokens after the longest prefix shared with the previous call, so from the second
+# chunk on the instruction is not evaluated again. A hit is only counted when the cached
+# tokens really cover the prefix.
+def check_prefix_cache(llm, tokens):
+    if llm not in _prefix_tokens:
+        _prefix_tokens[llm] = tokenize_prompt(llm, PROMPT_PREFIX)
+    n_prefix = _shared_length(_prefix_tokens[llm], tokens)
+    cached = _shared_length(list(llm.input_ids[:llm.n_tokens]), tokens)
+    _prefix_cache_stats["hits" if n_prefix and cached >= n_prefix else "misses"] += 1
+
+# Function to get a copy of the prefix cache hit and miss counters
+def prefix_cache_stats():
+    return dict(_prefix_cache_stats)
+
+# Add a completion's token counts to the running totals
+def _record_usage(prompt_tokens, completion_tokens):
+    _token_usage["prompt_tokens"] += prompt_tokens
+    _token_usage["completion_tokens"] += completion_tokens
+
+# Function to get a copy of the prompt and completion token totals
+def token_usage():
+    return dict(_token_usage)
+
+# Function to pull the JSON array of flashcards out of a model response
+def parse_flashcards(response_text):
+    json_start = response_text.find('[')
+    json_end = response_text.rfind(']') + 1
+
+    if json_start >= 0 and json_end > json_start:
+        return json.loads(response_text[json_start:json_end])
+    return []
+
+# Incremental parser for a streamed JSON array of flashcards: feed() takes the next piece
+# of completion text and returns the flashcards whose objects were closed by it
+class FlashcardStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.in_array = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.errors = []
+
+    def feed(self, text):
+        self.buffer += text
+        flashcards = []
+        while self.position < len(self.buffer) and not self.finished:
+            char = self.buffer[self.position]
+            if not self.in_array:
+                self.in_array = char == '['
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    card = self._parse_object(self.buffer[self.object_start:self.position + 1])
+                    if card:
+                        flashcards.append(card)
+            elif char == ']' and self.depth == 0:
+                self.finished = True
+            self.position += 1
+        return flashcards
+
+    def _parse_object(self, object_text):
+        try:
+            card = json.loads(object_text)
+        except ValueError as e:
+            self.errors.append(str(e))
+            return None
+        if not isinstance(card, dict) or "question" not in card or "answer" not in card:
+            self.errors.append(f"Flashcard without question and answer: {object_text[:80]}")
+            return None
+        return {"question": card["question"], "answer": card["answer"]}
+
+# Function to run the model on a single chunk and return the completion.
+# The completion is streamed so the time to first token is measured the same way as in
+# stream_flashcards. The call's duration and time to first token are added as
+# output["seconds"] and output["first_token_seconds"], so calls made in worker
+# processes can be recorded by the parent.
+def complete_chunk(llm, chunk):
+    start = time.perf_counter()
+    tokens = tokenize_prompt(llm, build_prompt(chunk))
+    check_prefix_cache(llm, tokens)
+    pieces = []
+    first_token_seconds = None
+    finish_reason = None
+    # Streamed parts carry no usage; each part is one generated token
+    for part in llm(prompt=tokens, stream=True, echo=False, **completion_params()):
+        if first_token_seconds is None:
+            first_token_seconds = time.perf_counter() - start
+        pieces.append(part['choices'][0]['text'])
+        finish_reason = part['choices'][0].get('finish_reason') or finish_reason
+    return {
+        "choices": [{"text": "".join(pieces), "index": 0, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": len(tokens), "completion_tokens": len(pieces),
+                  "total_tokens": len(tokens) + len(pieces)},
+        "seconds": time.perf_counter() - start,
+        "first_token_seconds": first_token_seconds,
+    }
+
+# Identifier of the loaded model used in generation cache keys
+def model_id(llm):
+    return generation_cache.model_fingerprint(getattr(llm, "model_path", settings.MODEL_PATH))
+
+# Function to generate flashcards and yield each one as soon as the model has closed its
+# JSON object, so the first cards can be shown long before the last chunk is done
+def stream_flashcards(text, llm, progress_callback=None, warning_callback=None, use_cache=True):
+    if not text or len(text.strip()) == 0:
+        return
+
+    text_chunks = split_into_chunks(text, llm, warning_callback)
+    llm_model_id = model_id(llm)
+
+    for i, chunk in enumerate(text_chunks):
+        key = generation_cache.cache_key(chunk, llm_model_id, PROMPT_VERSION, generation_params())
+        flashcards = generation_cache.get_cached_cards(key) if use_cache else None
+
+        if flashcards is not None:
+            yield from flashcards
+        else:
+            start = time.perf_counter()
+            tokens = tokenize_prompt(llm, build_prompt(chunk))
+            check_prefix_cache(llm, tokens)
+            parser = FlashcardStreamParser()
+            flashcards = []
+            completion_tokens = 0
+            first_token_seconds = None
+            parse_seconds = 0.0
+            # Streamed parts carry no usage; each part is one generated token
+            for part in llm(prompt=tokens, stream=True, echo=False, **completion_params()):
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - start
+                completion_tokens += 1
+                parse_start = time.perf_counter()
+                new_cards = parser.feed(part['choices'][0]['text'])
+                parse_seconds += time.perf_counter() - parse_start
+                for card in new_cards:
+                    flashcards.append(card)
+                    yield card
+            _record_usage(len(tokens), completion_tokens)
+            # Time spent by the caller on the yielded cards is included in the call's duration
+            metrics.record("llm", time.perf_counter() - start, label=f"chunk {i+1}",
+                           prompt_tokens=len(tokens), completion_tokens=completion_tokens,
+                           first_token_seconds=first_token_seconds)
+            parse_error = parser.errors[0] if parser.errors else None
+            if not flashcards:
+                parse_error = parse_error or "No flashcards in the completion"
+            metrics.record("parse", parse_seconds, label=f"chunk {i+1}", error=parse_error)
+
+            if parser.errors and warning_callback:
+                warning_callback(f"Could not parse all flashcards from chunk {i+1}: {parser.errors[0]}")
+            if flashcards and use_cache:
+                generation_cache.put_cached_cards(key, flashcards)
+
+        if progress_callback:
+            progress_callback(i + 1, len(text_chunks))
+
+# Threads each worker gets: the configured value, or an even share of the CPU cores
+def threads_per_worker(workers):
+    if settings.LLM_THREADS_PER_WORKER > 0:
+        return settings.LLM_THREADS_PER_WORKER
+    return max(1, (os.cpu_count() or 1) // workers)
+
+# Runs once in every worker process: load a private model over the shared GGUF file
+def _init_worker(n_threads):
+    global _worker_llm
+    _worker_llm = load_model(n_threads)
+
+# Runs in a worker process: generate the completion text for one chunk
+def _complete_chunk_in_worker(chunk):
+    return complete_chunk(_worker_llm, chunk)
+
+# Function to get the worker pool, starting it (or resizing it) on first use
+def get_worker_pool(workers):
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is not None and _worker_pool_size != workers:
+        shutdown_worker_pool()
+    if _worker_pool is None:
+        # Spawned rather than forked workers: llama.cpp's threads don't survive a fork
+        _worker_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads_per_worker(workers),)
+        )
+        _worker_pool_size = workers
+    return _worker_pool
+
+# Function to stop the worker pool and free the workers' models
+def shutdown_worker_pool():
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+        _worker_pool = None
+        _worker_pool_size = 0
+
+atexit.register(shutdown_worker_pool)
+
+# Yield the completion of every chunk in document order, either in this
+# process or spread over the worker pool
+def _complete_chunks(llm, text_chunks, workers):
+    if workers <= 1 or len(text_chunks) <= 1:
+        for chunk in text_chunks:
+            yield complete_chunk(llm, chunk)
+        return
+
+    pool = get_worker_pool(workers)
+    futures = [pool.submit(_complete_chunk_in_worker, chunk) for chunk in text_chunks]
+    for future in futures:
+        yield future.result()
+
+# Function to generate flashcards for every chunk of a text.
+# progress_callback(done, total) and warning_callback(message) let the caller report progress.
+def generate_flashcards(text, llm, progress_callback=None, warning_callback=None,
+                        workers=None, use_cache=True):
+    if not text or len(text.strip()) == 0:
+        return []
+    if workers is None:
+        workers = settings.LLM_WORKERS
+
+    text_chunks = split_into_chunks(text, llm, warning_callback)
+    llm_model_id = model_id(llm)
+
+    # Reuse the cards of chunks that were already generated with the same model and settings
+    keys = [generation_cache.cache_key(chunk, llm_model_id, PROMPT_VERSION, generation_params())
+            for chunk in text_chunks]
+    if use_cache:
+        chunk_flashcards = [generation_cache.get_cached_cards(key) for key in keys]
+    else:
+        chunk_flashcards = [None] * len(text_chunks)
+    pending = [i for i, flashcards in enumerate(chunk_flashcards) if flashcards is None]
+
+    done = len(text_chunks) - len(pending)
+    if progress_callback and done:
+        progress_callback(done, len(text_chunks))
+
+    outputs = _complete_chunks(llm, [text_chunks[i] for i in pending], workers)
+    for i, output in zip(pending, outputs):
+        usage = output.get('usage', {})
+        _record_usage(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+        metrics.record("llm", output.get("seconds", 0.0), label=f"chunk {i+1}",
+                       prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'),
+                       first_token_seconds=output.get("first_token_seconds"))
+        response_text = output['choices'][0]['text']
+        try:
+            with metrics.timer("parse", f"chunk {i+1}") as sample:
+                flashcards = parse_flashcards(response_text)
+                if not flashcards:
+                    sample["error"] = "No flashcards in the completion"
+            if flashcards and use_cache:
+                generation_cache.put_cached_cards(keys[i], flashcards)
+        except Exception as e:
+            flashcards = []
+            if warning_callback:
+                warning_callback(f"Could not parse flashcards from chunk {i+1}: {str(e)}")
+        chunk_flashcards[i] = flashcards
+
+        done += 1
+        if progress_callback:
+            progress_callback(done, len(text_chunks))
+
+    all_flashcards = []
+    for flashcards in chunk_flashcards:
+        all_flashcards.extend(flashcards)
+    return all_flashcards
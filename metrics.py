@@ -0,0 +1,180 @@
+import argparse
+import atexit
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import database
+import settings
+
+# Per-stage timing and token instrumentation. Every extraction, chunking, LLM call, parse and
+# database operation is recorded as one row of the metrics table, buffered in memory and
+# written in batches. Running totals per stage are kept in metrics_totals for the
+# Prometheus export, so pruning old rows doesn't reset the counters.
+#
+#     python metrics.py --port 9464     (serves the Prometheus text format on /metrics)
+
+_pending = []
+_pending_lock = threading.Lock()
+_last_flush = time.time()
+
+# Function to record one operation of a pipeline stage
+def record(stage, seconds, label=None, prompt_tokens=None, completion_tokens=None,
+           first_token_seconds=None, error=None):
+    global _last_flush
+    if not settings.METRICS_ENABLED:
+        return
+    with _pending_lock:
+        _pending.append((time.time(), stage, label, seconds, prompt_tokens, completion_tokens,
+                         first_token_seconds, error))
+        if len(_pending) < 100 and time.time() - _last_flush < settings.METRICS_FLUSH_SECONDS:
+            return
+        _last_flush = time.time()
+    flush()
+
+# Time the block and record it. The block can add fields to the yielded dict, e.g. the label
+# or token counts once they are known; an exception is recorded as the operation's error.
+@contextlib.contextmanager
+def timer(stage, label=None):
+    sample = {"label": label}
+    start = time.perf_counter()
+    try:
+        yield sample
+    except Exception as e:
+        sample["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, **sample)
+
+# Function to write the buffered rows to the database
+def flush():
+    with _pending_lock:
+        rows = _pending[:]
+        _pending.clear()
+    if not rows:
+        return
+
+    totals = {}
+    for _, stage, _, seconds, prompt_tokens, completion_tokens, _, error in rows:
+        total = totals.setdefault(stage, [0, 0, 0.0, 0, 0])
+        total[0] += 1
+        total[1] += error is not None
+        total[2] += seconds
+        total[3] += prompt_tokens or 0
+        total[4] += completion_tokens or 0
+
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.executemany('''INSERT INTO metrics (created_at, stage, label, seconds, prompt_tokens,
+                                              completion_tokens, first_token_seconds, error)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        c.executemany('''INSERT INTO metrics_totals (stage, calls, errors, seconds, prompt_tokens, completion_tokens)
+                         VALUES (?, ?, ?, ?, ?, ?)
+                         ON CONFLICT(stage) DO UPDATE SET
+                             calls = calls + excluded.calls,
+                             errors = errors + excluded.errors,
+                             seconds = seconds + excluded.seconds,
+                             prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                             completion_tokens = completion_tokens + excluded.completion_tokens''',
+                      [(stage, *total) for stage, total in totals.items()])
+        c.execute("DELETE FROM metrics WHERE created_at < ?",
+                  (time.time() - settings.METRICS_RETENTION_DAYS * 86400,))
+
+atexit.register(flush)
+
+# Value at fraction q of a sorted list
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+# Function to summarize every stage since a Unix timestamp: call and error counts,
+# total, median and 95th percentile seconds, and for LLM calls the token throughput
+def stage_summary(since):
+    flush()
+    with database.connection() as conn:
+        rows = conn.execute('''SELECT stage, seconds, error, prompt_tokens, completion_tokens, first_token_seconds
+                               FROM metrics WHERE created_at >= ? ORDER BY stage''', (since,)).fetchall()
+
+    stages = {}
+    for stage, seconds, error, prompt_tokens, completion_tokens, first_token_seconds in rows:
+        stages.setdefault(stage, []).append((seconds, error, prompt_tokens, completion_tokens, first_token_seconds))
+
+    summary = []
+    for stage, samples in stages.items():
+        times = sorted(sample[0] for sample in samples)
+        prompt_tokens = sum(sample[2] or 0 for sample in samples)
+        completion_tokens = sum(sample[3] or 0 for sample in samples)
+        first_token_times = [sample[4] for sample in samples if sample[4] is not None]
+        # Decoding time excludes prompt evaluation wherever the time to first token is known
+        decode_seconds = sum(sample[0] - (sample[4] or 0) for sample in samples if sample[3])
+        summary.append({
+            "stage": stage,
+            "calls": len(samples),
+            "errors": sum(1 for sample in samples if sample[1] is not None),
+            "error_rate": sum(1 for sample in samples if sample[1] is not None) / len(samples),
+            "total_seconds": sum(times),
+            "p50_seconds": _percentile(times, 0.5),
+            "p95_seconds": _percentile(times, 0.95),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "mean_completion_tokens": completion_tokens / len(samples),
+            "mean_first_token_seconds": (sum(first_token_times) / len(first_token_times)
+                                         if first_token_times else None),
+            "tokens_per_second": completion_tokens / decode_seconds if decode_seconds > 0 else None,
+        })
+    return sorted(summary, key=lambda stage: stage["total_seconds"], reverse=True)
+
+# Function to get the slowest operations since a Unix timestamp
+def slowest_operations(since, limit=20):
+    flush()
+    with database.connection() as conn:
+        return conn.execute('''SELECT created_at, stage, label, seconds, prompt_tokens, completion_tokens, error
+                               FROM metrics WHERE created_at >= ? ORDER BY seconds DESC LIMIT ?''',
+                            (since, limit)).fetchall()
+
+# Function to render the running totals in the Prometheus text exposition format
+def prometheus_text():
+    flush()
+    with database.connection() as conn:
+        totals = conn.execute('''SELECT stage, calls, errors, seconds, prompt_tokens, completion_tokens
+                                 FROM metrics_totals ORDER BY stage''').fetchall()
+
+    series = [
+        ("flashcards_stage_calls_total", "Operations recorded per pipeline stage", 1),
+        ("flashcards_stage_errors_total", "Operations per pipeline stage that failed", 2),
+        ("flashcards_stage_seconds_total", "Time spent per pipeline stage", 3),
+        ("flashcards_prompt_tokens_total", "Prompt tokens evaluated per pipeline stage", 4),
+        ("flashcards_completion_tokens_total", "Completion tokens generated per pipeline stage", 5),
+    ]
+    lines = []
+    for name, description, column in series:
+        lines.append(f"# HELP {name} {description}.")
+        lines.append(f"# TYPE {name} counter")
+        for row in totals:
+            # Only LLM calls have token counts
+            if column < 4 or row[column]:
+                lines.append(f'{name}{{stage="{row[0]}"}} {row[column]}')
+    return "\n".join(lines) + "\n"
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the recorded metrics in the Prometheus text format")
+    parser.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args()
+
+    database.init_db()
+    print(f"Serving metrics on http://0.0.0.0:{args.port}/metrics")
+    ThreadingHTTPServer(("", args.port), _PrometheusHandler).serve_forever()
+
+if __name__ == "__main__":
+    main()
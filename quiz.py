@@ -0,0 +1,124 @@
+import collections
+import random
+import re
+import threading
+import numpy as np
+import database
+import metrics
+import settings
+
+# Multiple-choice quizzes built from saved decks without the model. The wrong choices for
+# a card are other cards' answers that resemble its own answer. Answers are embedded as
+# hashed word and character-trigram TF-IDF vectors, and the index of a deck is built once
+# and cached, so a quiz is a matrix product and a partial sort.
+
+WORD = re.compile(r"\w+")
+DIMENSIONS = 1024
+CHOICES = 4
+# Answers at least this similar to the right one could be right too, and aren't used
+MAX_SIMILARITY = 0.85
+
+_indexes = collections.OrderedDict()
+_indexes_lock = threading.Lock()
+
+# Hashed features of one answer: its words and the character trigrams of each word
+def _features(text):
+    features = []
+    for word in WORD.findall(text.lower()):
+        features.append(hash(word) % DIMENSIONS)
+        padded = f" {word} "
+        features.extend(hash(padded[i:i + 3]) % DIMENSIONS for i in range(len(padded) - 2))
+    return features
+
+# L2-normalized TF-IDF vectors of the texts, one row each
+def _tfidf(texts):
+    rows = []
+    columns = []
+    for row, text in enumerate(texts):
+        features = _features(text)
+        rows.extend([row] * len(features))
+        columns.extend(features)
+    cells = np.array(rows, dtype=np.int64) * DIMENSIONS + np.array(columns, dtype=np.int64)
+    counts = np.bincount(cells, minlength=len(texts) * DIMENSIONS).reshape(len(texts), DIMENSIONS)
+    counts = counts.astype(np.float32)
+    document_frequency = np.count_nonzero(counts, axis=0)
+    vectors = np.log1p(counts) * np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+# The cards of a deck and the distractor candidates for them: the deck's distinct answers,
+# topped up with answers from the user's other decks when the deck has too few
+def _build_index(deck_id):
+    with database.connection() as conn:
+        cards = conn.execute("SELECT question, answer FROM flashcards WHERE deck_id = ? ORDER BY id",
+                             (deck_id,)).fetchall()
+        candidates = list(dict.fromkeys(answer for _, answer in cards))
+        if len(candidates) < settings.QUIZ_MIN_CANDIDATES:
+            others = conn.execute('''SELECT f.answer FROM flashcards f
+                                     JOIN decks d ON d.id = f.deck_id
+                                     JOIN decks own ON own.id = ? AND own.username = d.username
+                                     WHERE f.deck_id != ?
+                                     ORDER BY f.id DESC LIMIT ?''',
+                                  (deck_id, deck_id, settings.QUIZ_MIN_CANDIDATES)).fetchall()
+            candidates = list(dict.fromkeys(candidates + [answer for answer, in others]))
+
+    positions = {answer: index for index, answer in enumerate(candidates)}
+    return {
+        "cards": cards,
+        "candidates": candidates,
+        "vectors": _tfidf(candidates),
+        # Row of every card's own answer among the candidates
+        "answer_rows": np.array([positions[answer] for _, answer in cards], dtype=np.int64),
+    }
+
+# Function to get the cached index of a deck, rebuilding it when the deck has changed
+def deck_index(deck_id):
+    with database.connection() as conn:
+        version = conn.execute("SELECT COUNT(*), MAX(id) FROM flashcards WHERE deck_id = ?",
+                               (deck_id,)).fetchone()
+    with _indexes_lock:
+        cached = _indexes.get(deck_id)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(deck_id)
+            return cached[1]
+
+    with metrics.timer("quiz.index", f"{version[0]} cards"):
+        index = _build_index(deck_id)
+    with _indexes_lock:
+        _indexes[deck_id] = (version, index)
+        while len(_indexes) > settings.QUIZ_CACHE_DECKS:
+            _indexes.popitem(last=False)
+    return index
+
+# Function to build a multiple-choice quiz of up to question_count cards of a deck. Each
+# question is a dict with the question, its choices and the index of the right choice.
+def build_quiz(deck_id, question_count, seed=None):
+    index = deck_index(deck_id)
+    rng = random.Random(seed)
+    with metrics.timer("quiz.build") as sample:
+        picked = rng.sample(range(len(index["cards"])), min(question_count, len(index["cards"])))
+        if not picked:
+            return []
+        answer_rows = index["answer_rows"][picked]
+        similarity = index["vectors"][answer_rows] @ index["vectors"].T
+        # Never offer the right answer, or one that says nearly the same, as a wrong choice
+        similarity[np.arange(len(picked)), answer_rows] = -np.inf
+        similarity[similarity >= MAX_SIMILARITY] = -np.inf
+
+        wrong_count = min(CHOICES - 1, len(index["candidates"]) - 1)
+        if wrong_count > 0:
+            closest = np.argpartition(-similarity, wrong_count - 1, axis=1)[:, :wrong_count]
+        else:
+            closest = np.empty((len(picked), 0), dtype=np.int64)
+
+        questions = []
+        for number, (card, wrong_rows) in enumerate(zip(picked, closest.tolist())):
+            question, answer = index["cards"][card]
+            # Too few dissimilar answers leaves fewer choices rather than near-duplicates
+            choices = [index["candidates"][wrong] for wrong in wrong_rows
+                       if similarity[number, wrong] > -np.inf]
+            choices.append(answer)
+            rng.shuffle(choices)
+            questions.append({"question": question, "choices": choices, "answer": choices.index(answer)})
+        sample["label"] = f"{len(questions)} questions"
+    return questions
@@ -0,0 +1,124 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+import database
+import metrics
+import settings
+
+# Spaced-repetition scheduling (SM-2). Every flashcard has a row in the reviews table with
+# its owner, ease, interval and due time, and the index on (username, due_at) gives the
+# next due cards without loading any deck. Grades are applied to the card state the caller
+# already holds and written by a background thread, so grading never waits for the database.
+
+# Grades offered after a card is shown, on SM-2's 0-5 quality scale
+GRADES = {"Again": 1, "Hard": 3, "Good": 4, "Easy": 5}
+
+logger = logging.getLogger(__name__)
+
+_writes = queue.Queue()
+# Cards whose new state is queued but not yet written, so they aren't fetched as still due
+_pending = set()
+_pending_lock = threading.Lock()
+_writer = None
+_writer_lock = threading.Lock()
+
+# Function to get up to limit due cards of a user, most overdue first, optionally only from
+# one deck. Each card is a dict with its text and review state.
+def next_due_cards(username, limit=None, deck_id=None):
+    limit = limit or settings.REVIEW_PREFETCH
+    with _pending_lock:
+        pending = set(_pending)
+    if deck_id is None:
+        where, params = "r.username = ?", (username,)
+    else:
+        where, params = "r.deck_id = ?", (deck_id,)
+    with metrics.timer("db.next_due_cards"), database.connection() as conn:
+        rows = conn.execute(f'''SELECT r.card_id, r.deck_id, f.question, f.answer, r.due_at, r.interval_days,
+                                       r.ease, r.repetitions, r.lapses
+                                FROM reviews r JOIN flashcards f ON f.id = r.card_id
+                                WHERE {where} AND r.due_at <= ?
+                                ORDER BY r.due_at LIMIT ?''',
+                             (*params, time.time(), limit + len(pending))).fetchall()
+    keys = ("card_id", "deck_id", "question", "answer", "due_at", "interval_days", "ease",
+            "repetitions", "lapses")
+    return [dict(zip(keys, row)) for row in rows if row[0] not in pending][:limit]
+
+# Function to count a user's due cards, up to limit (counting stops there)
+def count_due(username, limit=1000):
+    with database.connection() as conn:
+        return conn.execute('''SELECT COUNT(*) FROM (SELECT 1 FROM reviews
+                                                     WHERE username = ? AND due_at <= ? LIMIT ?)''',
+                            (username, time.time(), limit)).fetchone()[0]
+
+# The review state after answering a card with an SM-2 quality from 0 to 5
+def schedule(card, quality, now=None):
+    now = now or time.time()
+    ease = max(1.3, card["ease"] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        # Forgotten: learn the card again from the start, and see it again this session
+        repetitions = 0
+        interval_days = 0.0
+        lapses = card["lapses"] + 1
+        due_at = now + settings.REVIEW_RELEARN_SECONDS
+    else:
+        repetitions = card["repetitions"] + 1
+        if repetitions == 1:
+            interval_days = 1.0
+        elif repetitions == 2:
+            interval_days = 6.0
+        else:
+            interval_days = card["interval_days"] * ease
+        lapses = card["lapses"]
+        due_at = now + interval_days * 86400
+    return dict(card, due_at=due_at, interval_days=interval_days, ease=ease,
+                repetitions=repetitions, lapses=lapses)
+
+# Function to grade a card fetched with next_due_cards. The new state is computed
+# immediately and written in the background; returns it.
+def grade(card, quality):
+    now = time.time()
+    card = schedule(card, quality, now)
+    with _pending_lock:
+        _pending.add(card["card_id"])
+    _start_writer()
+    _writes.put((card["due_at"], card["interval_days"], card["ease"], card["repetitions"],
+                 card["lapses"], quality, now, card["card_id"]))
+    return card
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_loop, name="review-writer", daemon=True)
+            _writer.start()
+
+# Write queued grades, all that have accumulated in one transaction
+def _write_loop():
+    while True:
+        updates = [_writes.get()]
+        while True:
+            try:
+                updates.append(_writes.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with metrics.timer("db.save_grades", f"{len(updates)} grades"), database.connection() as conn:
+                conn.executemany('''UPDATE reviews SET due_at = ?, interval_days = ?, ease = ?, repetitions = ?,
+                                                       lapses = ?, last_grade = ?, reviewed_at = ?
+                                    WHERE card_id = ?''', updates)
+        except Exception:
+            # Keep the writer alive; the cards stay due and are shown again
+            logger.exception("Could not write %d review grades", len(updates))
+        with _pending_lock:
+            _pending.difference_update(update[-1] for update in updates)
+        for _ in updates:
+            _writes.task_done()
+
+# Function to wait until every grade so far is written
+def flush():
+    if _writer is not None:
+        _writes.join()
+
+atexit.register(flush)
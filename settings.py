@@ -0,0 +1,164 @@
+import os
+
+# Runtime settings for the flashcard generator.
+# Every value can be overridden with an environment variable of the same name.
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+# Path to the GGUF model file
+MODEL_PATH = os.environ.get("MODEL_PATH", "./Phi-3-mini-4k-instruct-q4.gguf")
+
+# Context window the model is loaded with
+N_CTX = _env_int("N_CTX", 4096)
+
+# Maximum number of tokens the model may generate per chunk
+MAX_TOKENS = _env_int("MAX_TOKENS", 1024)
+
+# Number of tokens repeated between neighbouring chunks so ideas that
+# straddle a chunk boundary are not lost
+CHUNK_OVERLAP_TOKENS = _env_int("CHUNK_OVERLAP_TOKENS", 64)
+
+# Tokens kept free in the context window on top of the prompt and max_tokens
+CHUNK_SAFETY_MARGIN = _env_int("CHUNK_SAFETY_MARGIN", 32)
+
+# SQLite database holding users, decks and caches
+DB_PATH = os.environ.get("DB_PATH", "flashcards.db")
+
+# Size limit of the on-disk generation cache before least recently used entries are evicted
+GENERATION_CACHE_MAX_BYTES = _env_int("GENERATION_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+
+# CPU threads the model uses (per worker when the worker pool is enabled)
+N_THREADS = _env_int("N_THREADS", 8)
+
+# CPU threads used for prompt evaluation; 0 uses N_THREADS
+N_THREADS_BATCH = _env_int("N_THREADS_BATCH", 0)
+
+# Prompt tokens evaluated per batch
+N_BATCH = _env_int("N_BATCH", 512)
+
+# Memory-map the model file (1) instead of reading it into memory (0)
+USE_MMAP = _env_int("USE_MMAP", 1)
+
+# Lock the model in RAM so it is never swapped out
+USE_MLOCK = _env_int("USE_MLOCK", 0)
+
+# Calibrate the thread, batch and memory settings above on first start and reuse the best
+# profile for this host and model file (1). Variables set explicitly still take precedence.
+AUTO_TUNE = _env_int("AUTO_TUNE", 0)
+
+# Model layers offloaded to the GPU, if one is available
+N_GPU_LAYERS = _env_int("N_GPU_LAYERS", 35)
+
+# Number of worker processes generating chunks in parallel; 1 generates in the app process
+LLM_WORKERS = _env_int("LLM_WORKERS", 1)
+
+# CPU threads given to each worker; 0 splits the machine's cores evenly between workers
+LLM_THREADS_PER_WORKER = _env_int("LLM_THREADS_PER_WORKER", 0)
+
+# Show flashcards in the app as soon as the model has written them (1) instead of after
+# the whole document has been processed (0). Only applies with LLM_WORKERS = 1.
+STREAM_FLASHCARDS = _env_int("STREAM_FLASHCARDS", 1)
+
+# Worker processes used to extract text from PDF pages; 0 uses one per CPU core
+EXTRACTION_WORKERS = _env_int("EXTRACTION_WORKERS", 0)
+
+# PDFs with fewer pages than this are extracted in the app process
+PARALLEL_PDF_MIN_PAGES = _env_int("PARALLEL_PDF_MIN_PAGES", 16)
+
+# Size limit of the on-disk cache of extracted page text
+PAGE_CACHE_MAX_BYTES = _env_int("PAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+
+# Tesseract executable used for OCR
+TESSERACT_PATH = os.environ.get("TESSERACT_PATH", r'C:\Program Files\Tesseract-OCR\tesseract.exe')
+
+# Resolution images are scaled down to before OCR
+OCR_TARGET_DPI = _env_int("OCR_TARGET_DPI", 300)
+
+# Longest side in pixels for images without resolution information (about A4 at 300 DPI)
+OCR_MAX_SIDE = _env_int("OCR_MAX_SIDE", 3500)
+
+# PDF pages with less extracted text than this are treated as scanned and OCR'd
+OCR_MIN_PAGE_CHARS = _env_int("OCR_MIN_PAGE_CHARS", 20)
+
+# Size limit of the on-disk cache of OCR results
+OCR_CACHE_MAX_BYTES = _env_int("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+
+# Idle SQLite connections kept open for reuse
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 8)
+
+# Decks shown per page in the sidebar
+DECKS_PER_PAGE = _env_int("DECKS_PER_PAGE", 20)
+
+# Flashcards shown per page of search results
+SEARCH_RESULTS_PER_PAGE = _env_int("SEARCH_RESULTS_PER_PAGE", 10)
+
+# Users whose deck lists are kept in memory
+DECK_LIST_CACHE_USERS = _env_int("DECK_LIST_CACHE_USERS", 256)
+
+# Run generation as background jobs (1) instead of inside the page's script run (0)
+BACKGROUND_GENERATION = _env_int("BACKGROUND_GENERATION", 0)
+
+# Seconds between job status refreshes in the app while a job is queued or running
+JOB_POLL_SECONDS = _env_int("JOB_POLL_SECONDS", 2)
+
+# Constrain decoding with a JSON grammar (1) so every completion parses, or sample freely (0)
+GRAMMAR_DECODING = _env_int("GRAMMAR_DECODING", 1)
+
+# Draft tokens from n-gram matches in the prompt and verify them in one pass (1), or decode
+# one token at a time (0)
+SPECULATIVE_DECODING = _env_int("SPECULATIVE_DECODING", 0)
+
+# Tokens drafted per speculative step
+SPECULATIVE_DRAFT_TOKENS = _env_int("SPECULATIVE_DRAFT_TOKENS", 10)
+
+# Due cards fetched from the database at a time while reviewing
+REVIEW_PREFETCH = _env_int("REVIEW_PREFETCH", 10)
+
+# Seconds until a card answered with "Again" is due again
+REVIEW_RELEARN_SECONDS = _env_int("REVIEW_RELEARN_SECONDS", 600)
+
+# Cards read or inserted per batch when exporting and importing decks
+BULK_BATCH_SIZE = _env_int("BULK_BATCH_SIZE", 5000)
+
+# Questions in a multiple-choice quiz
+QUIZ_QUESTIONS = _env_int("QUIZ_QUESTIONS", 10)
+
+# Decks smaller than this also draw wrong quiz answers from the user's other decks
+QUIZ_MIN_CANDIDATES = _env_int("QUIZ_MIN_CANDIDATES", 50)
+
+# Decks whose quiz answer index is kept in memory
+QUIZ_CACHE_DECKS = _env_int("QUIZ_CACHE_DECKS", 32)
+
+# Remove near-duplicate flashcards before a deck is saved (1) or keep every card (0)
+DEDUPE_CARDS = _env_int("DEDUPE_CARDS", 1)
+
+# Word and word-pair Jaccard similarity at which two flashcards count as duplicates
+DEDUPE_THRESHOLD = _env_float("DEDUPE_THRESHOLD", 0.7)
+
+# Skip chunks that hold too little to make flashcards from (1) or prompt every chunk (0)
+CHUNK_FILTER = _env_int("CHUNK_FILTER", 1)
+
+# Information score from 0 to 1 below which a chunk is skipped
+CHUNK_MIN_INFORMATION = _env_float("CHUNK_MIN_INFORMATION", 0.3)
+
+# Record per-stage timings and token counts in the metrics table (1) or not (0)
+METRICS_ENABLED = _env_int("METRICS_ENABLED", 1)
+
+# Seconds recorded metrics may stay in memory before they are written to the database
+METRICS_FLUSH_SECONDS = _env_int("METRICS_FLUSH_SECONDS", 5)
+
+# Days of individual metrics rows kept for the admin view
+METRICS_RETENTION_DAYS = _env_int("METRICS_RETENTION_DAYS", 7)
+
+# Comma-separated users who can open the admin metrics view; nobody unless configured
+ADMIN_USERS = [user.strip() for user in os.environ.get("ADMIN_USERS", "").split(",") if user.strip()]
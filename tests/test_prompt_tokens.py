@@ -0,0 +1,40 @@
+import os
+import pytest
+import llm_engine
+import settings
+from benchmarks.stub_llm import StubLlama
+
+# The prompt prefix is only reused from the KV cache when the tokens the model evaluates
+# start with the prefix's tokens. Run from the project root:
+#     python -m pytest tests
+
+def test_completion_evaluates_the_checked_tokens():
+    llm = StubLlama()
+    llm_engine.complete_chunk(llm, "Cells are the basic units of life.")
+    expected = llm_engine.tokenize_prompt(llm, llm_engine.build_prompt("Cells are the basic units of life."))
+    assert list(llm.input_ids) == expected
+
+def test_prefix_hit_only_when_prefix_is_cached():
+    llm = StubLlama()
+    before = llm_engine.prefix_cache_stats()
+    llm_engine.complete_chunk(llm, "Cells are the basic units of life.")
+    llm_engine.complete_chunk(llm, "Mitochondria produce ATP.")
+    llm.reset()
+    llm_engine.complete_chunk(llm, "Ribosomes make proteins.")
+    after = llm_engine.prefix_cache_stats()
+    assert after["hits"] - before["hits"] == 1
+    assert after["misses"] - before["misses"] == 2
+
+# With the real tokenizer: BOS first, control tokens as single special tokens, and the
+# prefix's tokens unchanged at the start of every chunk's prompt
+@pytest.mark.skipif(not os.path.exists(settings.MODEL_PATH), reason="model file not found")
+def test_prefix_tokens_match_the_model_tokenizer():
+    from llama_cpp import Llama
+    llm = Llama(model_path=settings.MODEL_PATH, vocab_only=True, verbose=False)
+    prefix = llm_engine.tokenize_prompt(llm, llm_engine.PROMPT_PREFIX)
+    user_token = llm.tokenize(b"<|user|>", add_bos=False, special=True)
+    assert len(user_token) == 1
+    assert prefix[:2] == [llm.token_bos()] + user_token
+    for chunk in ("Cells are the basic units of life.", "1. Photosynthesis\n\nLight reactions"):
+        tokens = llm_engine.tokenize_prompt(llm, llm_engine.build_prompt(chunk))
+        assert tokens[:len(prefix)] == prefix
@@ -0,0 +1,229 @@
+import collections
+import math
+import re
+
+# Rough characters-per-token ratio used when no tokenizer is available
+APPROX_CHARS_PER_TOKEN = 4
+
+# Sentence boundary: end punctuation followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+# Paragraph boundary: one or more blank lines
+PARAGRAPH_BOUNDARY = re.compile(r'\n\s*\n')
+
+# Header placed in front of each uploaded document's text
+DOCUMENT_HEADER = re.compile(r'^--- Text from (.+) ---$', re.MULTILINE)
+
+# Function to build the header that introduces a document's text
+def document_header(filename):
+    return f"--- Text from {filename} ---"
+
+# Split combined upload text back into one string per document so every
+# document is chunked on its own and editing one file leaves the others' chunks intact
+def split_documents(text):
+    starts = [m.start() for m in DOCUMENT_HEADER.finditer(text)]
+    if not starts or starts[0] > 0 and text[:starts[0]].strip():
+        starts.insert(0, 0)
+    ends = starts[1:] + [len(text)]
+    documents = [text[start:end].strip() for start, end in zip(starts, ends)]
+    return [document for document in documents if document]
+
+# Function to clean and optimize text before processing
+def optimize_text(text):
+    cleaned_lines = []
+    for line in text.split('\n'):
+        # Remove excessive whitespace inside the line
+        line = ' '.join(line.split())
+
+        if len(line) > 10:
+            cleaned_lines.append(line)
+        elif not line and cleaned_lines and cleaned_lines[-1]:
+            # Keep a single blank line so paragraph breaks survive
+            cleaned_lines.append('')
+        # Very short lines (likely noise) are dropped
+
+    # Join back with newlines
+    return '\n'.join(cleaned_lines).strip()
+
+# Fallback token counter for when no model tokenizer is loaded
+def approx_token_count(text):
+    return max(1, len(text) // APPROX_CHARS_PER_TOKEN)
+
+# Build a token counter that uses the loaded model's tokenizer
+def llm_token_counter(llm):
+    def count_tokens(text):
+        return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+    return count_tokens
+
+# Split a word that is larger than the budget (text without spaces, URLs, encoded data)
+# into the longest runs of characters that fit
+def _split_long_word(word, count_tokens, budget):
+    pieces = []
+    while word:
+        # A token rarely spans more than 8 characters, so longer prefixes can't fit
+        low, high = 1, min(len(word), budget * 8)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(word[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        pieces.append(word[:low])
+        word = word[low:]
+    return pieces
+
+# Split a sentence that is larger than the budget on word boundaries
+def _split_long_sentence(sentence, count_tokens, budget):
+    pieces = []
+    words = []
+    words_tokens = 0
+    for word in sentence.split(' '):
+        word_tokens = count_tokens(' ' + word)
+        if word_tokens > budget:
+            if words:
+                pieces.append(' '.join(words))
+                words = []
+                words_tokens = 0
+            pieces.extend(_split_long_word(word, count_tokens, budget))
+            continue
+        if words and words_tokens + word_tokens > budget:
+            pieces.append(' '.join(words))
+            words = []
+            words_tokens = 0
+        words.append(word)
+        words_tokens += word_tokens
+    if words:
+        pieces.append(' '.join(words))
+    return pieces
+
+# Break text into (piece, token_count, starts_paragraph) units that each fit the budget
+def _text_units(text, count_tokens, budget):
+    for paragraph in PARAGRAPH_BOUNDARY.split(text):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+
+        starts_paragraph = True
+        for sentence in SENTENCE_BOUNDARY.split(paragraph):
+            tokens = count_tokens(sentence)
+            if tokens < budget:
+                pieces = [(sentence, tokens)]
+            else:
+                pieces = [(piece, count_tokens(piece))
+                          for piece in _split_long_sentence(sentence, count_tokens, budget - 1)]
+            for piece, piece_tokens in pieces:
+                # One extra token for the whitespace that joins the pieces back together
+                yield piece, piece_tokens + 1, starts_paragraph
+                starts_paragraph = False
+
+# Join units back together, keeping paragraph breaks
+def _join_units(units):
+    parts = []
+    for piece, _, starts_paragraph in units:
+        if parts:
+            parts.append('\n\n' if starts_paragraph else ' ')
+        parts.append(piece)
+    return ''.join(parts)
+
+# Take the trailing units of a chunk that fit in the overlap budget
+def _overlap_tail(units, overlap_tokens):
+    tail = []
+    tail_tokens = 0
+    for unit in reversed(units):
+        if tail_tokens + unit[1] > overlap_tokens:
+            break
+        tail.insert(0, unit)
+        tail_tokens += unit[1]
+    return tail
+
+# Split text into chunks of at most `budget` tokens on paragraph and sentence
+# boundaries, repeating up to `overlap_tokens` tokens between neighbouring chunks.
+def chunk_text(text, count_tokens, budget, overlap_tokens=0):
+    if budget <= 0:
+        raise ValueError("Chunk token budget must be positive")
+    overlap_tokens = max(0, min(overlap_tokens, budget // 2))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    has_new_content = False
+
+    for unit in _text_units(text, count_tokens, budget):
+        if current and current_tokens + unit[1] > budget:
+            chunks.append(_join_units(current))
+            current = _overlap_tail(current, overlap_tokens)
+            current_tokens = sum(u[1] for u in current)
+            if current_tokens + unit[1] > budget:
+                current = []
+                current_tokens = 0
+            has_new_content = False
+
+        current.append(unit)
+        current_tokens += unit[1]
+        has_new_content = True
+
+    # Skip a trailing chunk that would only repeat the previous overlap
+    if current and has_new_content:
+        chunks.append(_join_units(current))
+
+    return chunks
+
+# Lines of a table of contents with dot leaders, e.g. "2.1 Cell membranes ........ 14"
+DOT_LEADER_LINE = re.compile(r'(?:\.\s*){4,}\d+$')
+
+# Marks of a bibliography entry: a parenthesized year, "et al.", page ranges, volumes,
+# DOIs and URLs
+CITATION = re.compile(r'\(\s*(?:1[5-9]|20)\d{2}[a-z]?\s*\)|\bet al\.|\bpp?\.\s*\d|\b[Vv]ol\.\s*\d'
+                      r'|\bdoi\b|https?://|\b\d+\s*\(\d+\)\s*[:,]\s*\d+', re.IGNORECASE)
+
+WORD = re.compile(r'[^\W\d_]+|\d+')
+VOWEL = re.compile(r'[aeiouy]', re.IGNORECASE)
+
+# Function to remove lines that carry no content from an optimized document:
+# table-of-contents lines with dot leaders, and lines that repeat on many pages such as
+# running headers and footers (digits are ignored when comparing, so "Page 3 of 40"
+# footers match each other)
+def strip_boilerplate(text, min_repeats=3):
+    lines = text.split('\n')
+    shapes = [re.sub(r'\d+', '#', line.lower()) for line in lines]
+    repeats = {}
+    for shape in shapes:
+        if shape:
+            repeats[shape] = repeats.get(shape, 0) + 1
+    kept = [line for line, shape in zip(lines, shapes)
+            if not (DOT_LEADER_LINE.search(line)
+                    or shape and len(line) <= 100 and repeats[shape] >= min_repeats)]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(kept)).strip()
+
+# Linear ramp from 0 at `low` to 1 at `high`, clipped to [0, 1]
+def _ramp(value, low, high):
+    return min(1.0, max(0.0, (value - low) / (high - low)))
+
+# Function to estimate how much flashcard material a chunk holds, from 0 to 1, and the
+# main reason when it is low. Each heuristic gives a factor between 0 and 1 and the score
+# is their product, so any one of them can rule a chunk out.
+def information_score(chunk, min_words=10):
+    words = WORD.findall(chunk)
+    if not words:
+        return 0.0, "no text"
+    alphabetic = [word for word in words if not word.isdigit()]
+    letters = sum(map(len, alphabetic))
+    visible = len(''.join(chunk.split()))
+    # Garbled OCR produces long runs of consonants; short words (units, symbols) and
+    # scripts without vowels are not judged
+    judged = [word for word in alphabetic if len(word) >= 3 and word.isascii()]
+    wordlike = sum(1 for word in judged if VOWEL.search(word) and len(word) <= 25)
+
+    counts = collections.Counter(word.lower() for word in words)
+    entropy = -sum(count / len(words) * math.log2(count / len(words)) for count in counts.values())
+    entropy_ratio = entropy / math.log2(len(words)) if len(words) > 1 else 1.0
+
+    factors = {
+        "too little text": _ramp(len(words), 0, min_words),
+        "unreadable text": _ramp(letters / visible, 0.25, 0.6) * _ramp(wordlike / len(judged) if judged else 1.0, 0.5, 0.8),
+        "repetitive text": _ramp(entropy_ratio, 0.3, 0.6),
+        "mostly numbers (contents, index or table)": 1 - _ramp((len(words) - len(alphabetic)) / len(words), 0.15, 0.45),
+        "mostly citations": 1 - _ramp(len(CITATION.findall(chunk)) * 100 / len(words), 1.0, 5.0),
+    }
+    score = math.prod(factors.values())
+    return score, min(factors, key=factors.get)